@@ -14,6 +14,75 @@ LOG_PATH = os.path.join(ROOT_PATH, 'log')
 LIB_PATH = os.path.join(ROOT_PATH, 'lib')
 # ===================== FORBIDDEN CHANGE =====================
 
+# Webhook Job Queue
+WEBHOOK_WORKERS = 4  # number of review worker threads
+WEBHOOK_QUEUE_SIZE = 500  # max pending events, webhook returns 503 when full
+COALESCE_QUIET_PERIOD = 20  # seconds to wait for further pushes before reviewing a `synchronize`
+DEDUP_DB_PATH = os.path.join(LIB_PATH, 'deliveries.sqlite3')  # X-GitHub-Delivery idempotency store
+DEDUP_TTL = 3 * 24 * 3600  # seconds a delivery id is remembered
+
+# GitHub HTTP Pool
+GITHUB_POOL_SIZE = 20  # keep-alive connections per host, shared by all workers
+GITHUB_POOL_HOSTS = 4  # number of hosts kept in the pool
+
+# AI Prompt Budget (prompt tokens, completion headroom already deducted)
+MODEL_TOKEN_BUDGET = {
+    "VIO:Gemini 2.5 Pro": 500000,
+    "VIO:GPT 5-chat": 100000,
+    "deepseek-reasoner": 50000,
+}
+DEFAULT_TOKEN_BUDGET = 100000
+REVIEW_SHARD_WORKERS = 4  # parallel AI calls when a large PR is reviewed in file groups
+
+# AI Prompt Templates
+PROMPT_TEMPLATE_PATH = os.path.join(CONFIG_PATH, 'prompts')  # <project>/<name>.<language>.md, falls back to default/
+
+# Qtools Rules
+QTOOLS_PROMPT_CACHE_SIZE = 256  # rendered rule prompts kept per process (LRU)
+QTOOLS_SYNC_WORKERS = 4  # repos synced in parallel by tools/qtools_processor.py
+
+# AI Review Cache
+REVIEW_CACHE_DB_PATH = os.path.join(LIB_PATH, 'review_cache.sqlite3')
+REVIEW_CACHE_MAX_ENTRIES = 2000  # least recently used reviews are evicted beyond this
+REVIEW_CACHE_MAX_AGE = 14 * 24 * 3600  # seconds a cached review stays valid
+
+# AI Client Pool
+AI_POOL_MAX_CONNECTIONS = 20  # per (base_url, api key) client
+AI_POOL_MAX_KEEPALIVE = 10
+AI_TIMEOUT = 600  # seconds, a full review on a large diff can take minutes
+AI_CONNECT_TIMEOUT = 10
+AI_KEY_FAILURE_THRESHOLD = 3  # consecutive failures before a VIO key's circuit opens
+AI_KEY_COOLDOWN = 60  # seconds an open key is skipped
+AI_KEY_BUDGET_COOLDOWN = 3600  # seconds a key is skipped after "budget has been exceeded" or an auth error
+AI_HEDGE = False  # race the local model against a slow VIO request in AIPrReview.chat
+AI_HEDGE_DELAY = 30  # seconds before hedging until enough VIO latencies are known, then their p95 is used
+AI_HEDGE_MIN_DELAY = 5
+AI_HEDGE_WORKERS = 8
+AI_ENDPOINT_CONCURRENCY = 8  # in-flight requests per AI base url, excess requests wait in FIFO order
+AI_KEY_CONCURRENCY = 4  # in-flight requests per API key
+AI_TOKENS_PER_MINUTE = 1000000  # prompt tokens admitted per minute per AI base url
+AI_ADMISSION_TIMEOUT = 300  # seconds a request may wait for admission before it fails
+AI_USAGE_TABLE = "model_aiusage"  # one row per AI call, aggregated by tools/usage_report.py
+
+# AI Review Streaming
+REVIEW_STREAM = True  # stream the review and update the PR comment while it is generated
+REVIEW_STREAM_INTERVAL = 10  # seconds between comment updates
+REVIEW_STREAM_TOKENS = 400  # or after this many new tokens, whichever comes first
+
+# AI Post Check
+POST_CHECK_ASYNC = True  # post the review first, score it in the background and update comment and DB
+POST_CHECK_SAMPLE_RATE = 1.0  # fraction of reviews that get a post check, lower it under peak load
+
+# AI Model Routing
+# First matching rule wins. Conditions (all optional): max_changed_lines, max_files, max_tokens (diff),
+# file_types (every changed file must end with one of them). "endpoint" is "vio" or "local".
+# A project can override the rules with "Review_routes" in PROJECT_MAPPING.
+DEFAULT_REVIEW_ROUTES = [
+    {"name": "trivial", "max_changed_lines": 20, "file_types": [".md", ".txt", ".json", ".yml", ".yaml", ".cfg", ".ini"], "model": "deepseek-reasoner", "endpoint": "local"},
+    {"name": "small", "max_changed_lines": 300, "max_tokens": 20000, "model": "VIO:GPT 5-chat", "endpoint": "vio"},
+    {"name": "long_context", "model": "VIO:Gemini 2.5 Pro", "endpoint": "vio"},
+]
+
 
 # Project Map
 PROJECT_MAPPING = {
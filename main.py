@@ -7,7 +7,7 @@ from dotenv import load_dotenv
 def main(request):
     event = request.headers.get('X-GitHub-Event', None)
     action = request.json.get('action', None)
-    
+
     load_dotenv(ENV_PATH)
 
     # 设置初始化变量
@@ -3,17 +3,72 @@ import json
 from datetime import datetime, timedelta, timezone
 import logging
 import os
-import openai
-import httpx
 import base64
 import psycopg2
 from psycopg2 import pool
 import threading
-from src.modules import setup_watchdog, AIPrReview
-from configs.config import JIRA_URL, LOG_PATH, PROJECT_MAPPING
+import time
+import random
+from concurrent.futures import ThreadPoolExecutor
+from src.modules import setup_watchdog, AIPrReview, ai_clients, vio_keys, ai_admission, AdmissionTimeout, make_usage_record, pr_coalescer, ReviewSuperseded, github_pool, PRDiff, estimate_tokens, get_token_budget, ContextPacker, trim_tail, review_cache, review_stats, normalize_diff, model_router, prompt_registry
+from configs.config import JIRA_URL, LOG_PATH, PROJECT_MAPPING, REVIEW_SHARD_WORKERS, REVIEW_STREAM, REVIEW_STREAM_INTERVAL, REVIEW_STREAM_TOKENS
+from configs.config import POST_CHECK_ASYNC, POST_CHECK_SAMPLE_RATE, AI_USAGE_TABLE
 import requests
 
+DIFF_TRUNCATION_NOTE = "\n...\n*The diff content is too long, has been truncated.*"
+REVIEW_MARKER_PATTERN = re.compile(r"\n*<!-- RevBot: (.*?) -->")  # hidden state in the review comment, e.g. the reviewed head sha
+CARRY_OVER_PATTERN = re.compile(r"\n*[^\n]*<!-- RevBot carried over -->")  # note of skip_same_patch_review
+REVIEW_TEMPLATES = ("review_system", "review_user", "review_rules", "review_incremental",
+                    "review_reduce", "review_reduce_group", "review_reduce_failed")  # templates that make up the review prompt
+REVIEW_COLUMNS = {  # db_sheet_name columns added after the original schema, created by tools/db_migrate.py
+    "review_mode": "TEXT",
+    "ai_route": "TEXT",
+    "ai_model": "TEXT",
+    "ai_endpoint": "TEXT",
+    "ai_latency": "DOUBLE PRECISION",
+    "ai_post_check_score": "INTEGER",
+    "ai_post_check_reason": "TEXT",
+    "prompt_version": "TEXT",
+    "prompt_templates": "TEXT",
+    "prompt_dropped_sections": "TEXT",
+    "ai_calls": "INTEGER",
+    "ai_retries": "INTEGER",
+    "ai_prompt_tokens": "INTEGER",
+    "ai_completion_tokens": "INTEGER",
+    "ai_cached_tokens": "INTEGER",
+    "ai_cache_hit_rate": "DOUBLE PRECISION",
+    "ai_usage": "TEXT",
+}
+USAGE_TABLE_DDL = f"""
+    CREATE TABLE IF NOT EXISTS {AI_USAGE_TABLE} (
+        id BIGSERIAL PRIMARY KEY,
+        html_url TEXT NOT NULL,
+        repository_owner_login TEXT,
+        repository_name TEXT,
+        pr_number INTEGER,
+        head_sha TEXT,
+        purpose TEXT,
+        model TEXT,
+        endpoint TEXT,
+        api_key_suffix TEXT,
+        prompt_tokens INTEGER,
+        completion_tokens INTEGER,
+        cached_tokens INTEGER,
+        latency DOUBLE PRECISION,
+        retries INTEGER,
+        estimated BOOLEAN,
+        prompt_version TEXT,
+        created_at TIMESTAMPTZ NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS {AI_USAGE_TABLE}_created_at_idx ON {AI_USAGE_TABLE} (created_at);
+    CREATE INDEX IF NOT EXISTS {AI_USAGE_TABLE}_html_url_idx ON {AI_USAGE_TABLE} (html_url);
+"""
+
 class AICodeReviewOrchestrator:
+    template_group = "default"  # prompt template group under PROMPT_TEMPLATE_PATH, subclasses select their project's
+    _usage_table_ready = False  # AI_USAGE_TABLE created by this process
+    _table_columns = {}  # table -> column names, queried once per process
+
     def __init__(
         self,
         github_token="",
@@ -43,11 +98,22 @@ class AICodeReviewOrchestrator:
         self.db_sheet_name = db_sheet_name
         self.db_config = db_config
         self.request = request
+        self.github = github_pool  # 进程内共享的 GitHub 连接池
+        self.fetch_timings = {}  # fetch name -> seconds
+        self.changed_files_detail = []  # filename/status/additions/deletions per changed file
+        self.pr_diff = None  # PRDiff parsed once per event
+        self._my_review_comment = None  # bot review comment of this PR, fetched at most once per event
+        self._pending_post_check = None  # post check to run after the review comment is posted
+        self._previous_review_body = ""  # review comment body before the streaming placeholder replaced it
+        self._progress_body = ""  # last placeholder/progress body published by this event
+        self.ai_usage = []  # make_usage_record() of every AI call of this event
 
         self.project = request.json.get('repository', {}).get("owner", {}).get("login", "")
         self.project_folder = PROJECT_MAPPING.get(self.project, {}).get("Project", "")
         self.repo_name = request.json.get('repository', {}).get("name", "")
         self.pr_number = request.json.get('pull_request', {}).get("number", 0)
+        self.pr_key = pr_coalescer.get_key(request.json)
+        self.head_sha = request.json.get('pull_request', {}).get('head', {}).get('sha', "")
         self.report_dir = os.path.join(LOG_PATH, self.project, "revbot_report")  # Directory to save review history
         if self.project_folder and self.repo_name and self.pr_number:
             self.setup_logging(self.report_dir, self.project_folder, self.repo_name, self.pr_number)
@@ -70,75 +136,191 @@ class AICodeReviewOrchestrator:
         logging.info(f"Logging setup complete. Log file: {log_file}")
 
     def _get_checklist_table(self):
-        markdown_table = """
-# 这是一个Checklist 的 demo 输出，用于测试RevBot在无法正确获得AI评估分数的情况下，返回的内容
+        return prompt_registry.render("checklist_table", self.template_group)
 
-# 请注意，这条评论应该仅仅出现在RevBot库中。
+    def _check_superseded(self):
+        """
+        Abort the running review when a newer head has been pushed to the same PR.
+        """
+        if pr_coalescer.is_superseded(self.pr_key, self.head_sha):
+            raise ReviewSuperseded(f"Head {self.head_sha} of PR {self.pr_number} is no longer current")
 
-# 这是正常的特性，请不用担心。
-"""
+    def _timed_fetch(self, name, func, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.fetch_timings[name] = round(elapsed, 3)
+            self.logger.info(f"Fetch {name} took {elapsed:.3f}s")
 
-        return markdown_table
+    def _fetch_concurrently(self, tasks):
+        """
+        Run independent fetches in parallel and join them.
+        `tasks` maps a fetch name to (func, kwargs), the result maps the same name to the return value.
+        """
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=len(tasks)) as executor:
+            futures = {
+                name: executor.submit(self._timed_fetch, name, func, **kwargs)
+                for name, (func, kwargs) in tasks.items()
+            }
+            results = {name: future.result() for name, future in futures.items()}
+        self.logger.info(f"Concurrent fetch of {list(tasks)} took {time.perf_counter() - start:.3f}s")
+        return results
+
+    def _get_pr_diff_model(self, git_diff_content):
+        """
+        Parse the diff once per event, later callers with the same text reuse the parsed model.
+        """
+        if self.pr_diff is None or self.pr_diff.text is not git_diff_content:
+            self.pr_diff = PRDiff(git_diff_content)
+        return self.pr_diff
 
-    def _get_prompt(self, ticket_detail, base_branch, repo, diff_content, language="zh"):
-        if language == "zh":
-            review_instruction = (
-                "# 以下修改属于基于AI的代码自动审核项目，请根据 Jira 需求和对应的 Github Pull Request 变更进行代码审查，并评估合并风险。\n"
-                "## 审查要求：\n"
-                "1. 必须用中文回答。\n"
-                "2. 对发现的问题可适当提供修改建议。\n"
-                "3. 输出结果必须严格按照以下结构组织：\n"
-                "   **1. 总体评价**：对整体代码质量、规范符合度、潜在风险进行综合评价。\n"
-                "   **2. 逐一文件建议和分析**：按文件逐个分析变更内容，指出问题、规范违规情况及修改建议。\n"
-                "   **3. 总结**：总结主要发现、风险等级及后续建议。\n"
-                "   **4. 合并风险评估**：在最后一行只输出一个单词字符表示风险等级（low / medium / high），不要有解释或额外内容。\n"
-            )
+    def _build_rules_prompt(self, language):
+        return ""
 
-            merge_instruction = (
-                "## 合并风险评估规则：\n"
-                "- low：代码规范好，变更范围小，无明显风险。\n"
-                "- medium：存在少量规范问题或潜在风险，但可以接受。\n"
-                "- high：存在严重规范问题、潜在错误或设计缺陷，不建议直接合并。\n"
-                "请根据你的整体分析，**在最终一行只输出一个单词字符作为合并风险结果（low / medium / high）**，不要输出多余内容或解释。"
-            )
+    def _trim_diff(self, pr_diff, files, text, max_tokens):
+        """
+        ContextPacker trimmer for the diff section: cut at file/hunk boundaries instead of mid-line.
+        """
+        max_chars = int(max_tokens * len(text) / max(estimate_tokens(text), 1))
+        return pr_diff.render(files=files, max_chars=max_chars, truncation_note=DIFF_TRUNCATION_NOTE)
 
-            question = (
-                f"{review_instruction}\n"
-                f"# 本次变更的 Jira 需求：\n{ticket_detail or '无'}\n\n"
-                f"# 本次变更的目标分支：\n{base_branch}\n\n"
-                f"# 仓库 {repo} 的 Pull Request 变更内容如下：\n{diff_content}\n\n"
-                f"{merge_instruction}"
-            )
-        else:
-            review_instruction = (
-                "# The following changes are part of an AI-based code review project. Please conduct a code review based on the Jira requirements and the corresponding GitHub Pull Request changes, and assess the merge risk.\n"
-                "## Review Requirements:\n"
-                "1. Must respond in English.\n"
-                "2. Provide modification suggestions for identified issues as appropriate.\n"
-                "3. The output must be strictly organized according to the following structure:\n"
-                "   **1. Overall Evaluation**: A comprehensive evaluation of overall code quality, compliance with standards, and potential risks.\n"
-                "   **2. File-by-File Suggestions and Analysis**: Analyze the changes file by file, pointing out issues, standard violations, and modification suggestions.\n"
-                "   **3. Summary**: Summarize the main findings, risk level, and follow-up recommendations.\n"
-                "   **4. Merge Risk Assessment**: At the very end, output only a single word character indicating the risk level (low / medium / high), without explanations or additional content.\n"
-            )
+    def _pack_prompt(self, ticket_detail, base_branch, repo, pr_diff, rules_text, budget, files=None):
+        """
+        Build the review prompt within `budget` tokens. Priority: instructions, diff, Jira, rules.
+        Return (prompt, dropped sections).
+        """
+        packer = ContextPacker(budget)
+        packer.add("instructions", self._get_instructions(base_branch, repo), priority=0, required=True)
+        packer.add("diff", pr_diff.render(files=files), priority=1, trimmer=lambda text, max_tokens: self._trim_diff(pr_diff, files, text, max_tokens))
+        packer.add("jira", ticket_detail, priority=2)
+        packer.add("rules", rules_text, priority=3)
+        packed = packer.pack()
 
-            merge_instruction = (
-                "## Merge Risk Assessment Rules:\n"
-                "- low: Good code standards, small change scope, no obvious risks.\n"
-                "- medium: A few standard issues or potential risks exist but are acceptable.\n"
-                "- high: Serious standard issues, potential errors, or design flaws exist; direct merging is not recommended.\n"
-                "Based on your overall analysis, **output only a single word character as the final merge risk result (low / medium / high) in the last line**, without any extra content or explanations."
-            )
+        if packer.dropped:
+            self.logger.warning(f"Prompt over {budget} tokens, trimmed sections: {packer.dropped}")
 
-            question = (
-                f"{review_instruction}\n"
-                f"# The Jira requirement for this change:\n{ticket_detail or 'None'}\n\n"
-                f"# The target branch for this change:\n{base_branch}\n\n"
-                f"# The Pull Request changes for repository {repo} are as follows:\n{diff_content}\n\n"
-                f"{merge_instruction}"
-            )
+        question = self._get_prompt(packed["jira"], base_branch, repo, packed["diff"], rule_descriptions=packed["rules"])
+        return question, packer.dropped
+
+    def _get_instructions(self, base_branch, repo):
+        """
+        The review prompt without Jira, rules and diff: system prompt plus the empty user prompt.
+        """
+        return self._get_system_prompt() + "\n\n" + self._get_prompt("", base_branch, repo, "", rule_descriptions="")
+
+    def _get_system_prompt(self, language="zh"):
+        """
+        Static review instructions, sent as the system message. Must not contain any per-PR data:
+        the text stays byte-identical across reviews so the provider can reuse its cached prefix.
+        """
+        return prompt_registry.render("review_system", self.template_group, language)
+
+    def _get_prompt(self, ticket_detail, base_branch, repo, diff_content, language="zh", rule_descriptions=None):
+        """
+        Per-PR part of the review prompt, sent as the user message after `_get_system_prompt`.
+        """
+        if rule_descriptions is None:
+            rule_descriptions = self._build_rules_prompt(language=language)
+
+        rules_text = ""
+        if rule_descriptions:
+            rules_text = prompt_registry.render("review_rules", self.template_group, language, rules=rule_descriptions.rstrip()) + "\n\n"
+
+        return prompt_registry.render(
+            "review_user", self.template_group, language,
+            jira=ticket_detail or ("无" if language == "zh" else "None"),
+            base_branch=base_branch,
+            rules=rules_text,
+            repo=repo,
+            diff=diff_content,
+        )
+
+    def _get_reduce_prompt(self, partial_reviews, failed_files, ticket_detail, base_branch, repo, language="zh"):
+        """
+        User message of the reduce call, which merges the group reviews of `_ai_pr_review_sharded`.
+        """
+        groups_text = "\n\n".join(
+            prompt_registry.render("review_reduce_group", self.template_group, language,
+                                   index=i, count=len(partial_reviews), files=", ".join(files), review=review)
+            for i, (files, review) in enumerate(partial_reviews, 1)
+        )
+        failed_text = ""
+        if failed_files:
+            failed_text = prompt_registry.render("review_reduce_failed", self.template_group, language, files=", ".join(failed_files)) + "\n\n"
+
+        return prompt_registry.render(
+            "review_reduce", self.template_group, language,
+            jira=ticket_detail or ("无" if language == "zh" else "None"),
+            base_branch=base_branch,
+            failed=failed_text,
+            repo=repo,
+            groups=groups_text,
+        )
+
+    def _ai_pr_review_sharded(self, pr_diff, ticket_detail, base_branch, repo, ai_model, rules_text="", dropped_sections=None, endpoint="vio"):
+        """
+        Map-reduce review for PRs whose prompt exceeds the model budget: review token-budgeted
+        file groups in parallel, then merge the group reviews with one reduce call.
+        Always reviews the whole PR, an incremental review that needs sharding becomes a full one.
+        Return (review_result, reduce_prompt).
+        """
+        budget = get_token_budget(ai_model)
+        # 分组大小优先为 Jira/规则预留空间，但至少占用指令之外一半的预算
+        available = budget - estimate_tokens(self._get_instructions(base_branch, repo))
+        diff_tokens = max(available - estimate_tokens(ticket_detail) - estimate_tokens(rules_text), available // 2, 1)
+        chars_per_token = len(pr_diff) / max(estimate_tokens(pr_diff.text), 1)
+        max_chars = int(diff_tokens * chars_per_token)
+
+        groups = pr_diff.group_files(max_chars)
+        self.logger.info(f"Prompt exceeds {budget} tokens, reviewing {len(pr_diff.files)} files in {len(groups)} groups")
+
+        def review_group(files):
+            self._check_superseded()
+            question, dropped = self._pack_prompt(ticket_detail, base_branch, repo, pr_diff, rules_text, budget, files=files)
+            if dropped_sections is not None:
+                dropped_sections.extend(dict(d, group=[f.path for f in files]) for d in dropped)
+            try:
+                return self.ai_request(question=question, system_prompt=self._get_system_prompt(), ai_model=ai_model, endpoint=endpoint, purpose="shard").strip()
+            except Exception as e:
+                self.logger.error(f"AI review of file group {[f.path for f in files]} failed: {e}")
+                return ""
+
+        with ThreadPoolExecutor(max_workers=min(len(groups), REVIEW_SHARD_WORKERS)) as executor:
+            group_reviews = list(executor.map(review_group, groups))
+
+        partial_reviews = [([f.path for f in files], review) for files, review in zip(groups, group_reviews) if review]
+        failed_files = [f.path for files, review in zip(groups, group_reviews) if not review for f in files]
+        self.logger.info(f"{len(partial_reviews)}/{len(groups)} file groups reviewed")
+        if not partial_reviews:
+            return "", ""
+
+        self._check_superseded()
+        question = self._get_reduce_prompt(partial_reviews, failed_files, ticket_detail, base_branch, repo)
+        return self.ai_request(question=question, system_prompt=self._get_system_prompt(), ai_model=ai_model, endpoint=endpoint, purpose="reduce"), question
 
-        return question
+    def _get_prompt_version(self):
+        """
+        Version of the review prompt: hash over the versions of the templates it is built from.
+        """
+        return prompt_registry.version(REVIEW_TEMPLATES, self.template_group)
+
+    def _get_incremental_prompt(self, previous_review, review_prompt, language="zh"):
+        """
+        User message of an incremental review: the previous review followed by the prompt of the new changes.
+        """
+        return prompt_registry.render("review_incremental", self.template_group, language, previous_review=previous_review, prompt=review_prompt)
+
+    def _get_review_marker(self, **fields):
+        return "\n\n<!-- RevBot: " + " ".join(f"{k}={v}" for k, v in fields.items() if v) + " -->"
+
+    def _parse_review_marker(self, body):
+        m = REVIEW_MARKER_PATTERN.search(body or "")
+        if not m:
+            return {}
+        return dict(item.split("=", 1) for item in m.group(1).split() if "=" in item)
 
     def _get_failed_review_result(self, jira_link, pr_url):
         md_checklist = self._get_checklist_table()
@@ -155,7 +337,7 @@ class AICodeReviewOrchestrator:
         repo = ""
         return changed_files + owner + repo
 
-    def ai_pr_review(self, git_diff_content="", db_payload={}, language="zh", jira_ticket_id="", jira_ticket_detail=""):
+    def ai_pr_review(self, git_diff_content="", db_payload={}, language="zh", jira_ticket_id="", jira_ticket_detail="", previous_review="", incremental_diff=""):
         repo_name = self.request.json.get("repository", {}).get("name", "")
         self.logger.info("Starting AI PR review process.")
         if not git_diff_content or not repo_name:
@@ -174,25 +356,105 @@ class AICodeReviewOrchestrator:
         # Qtools result filter
         pr_url = self.request.json.get('pull_request', {}).get('html_url', "")
         owner = self.request.json.get("repository", {}).get("owner", {}).get("login", "")
-        changed_files = self.get_changes_list()
+        pr_number = self.request.json.get('pull_request', {}).get("number", 0)
+        pr_diff = self._get_pr_diff_model(git_diff_content)
+        self.logger.info(f"Saving PR history for PR number: {pr_number}")
+
+        # 两者均为本地处理（解析已下载的 diff、写入历史文件），无需线程池
+        changed_files = self.get_changes_list(git_diff_content=git_diff_content)
+        self.save_history(jira_ticket_id, jira_ticket_detail, owner, repo_name, pr_number, git_diff_content)
         db_payload["changed_files_list"] = changed_files
         self.logger.info(f"Changed files: {changed_files}")
         self.rule_descriptions = self._get_qtools_result_filter(changed_files, owner, repo_name)
 
-        # Save Jira Thing to local
-        pr_number = self.request.json.get('pull_request', {}).get("number", 0)
-        self.logger.info(f"Saving PR history for PR number: {pr_number}")
-        self.save_history(jira_ticket_id, jira_ticket_detail, owner, repo_name, pr_number, git_diff_content)
+        # Incremental review: only send the changes since the last reviewed head
+        review_diff = pr_diff
+        if previous_review and incremental_diff and len(incremental_diff) < len(git_diff_content):
+            review_diff = PRDiff(incremental_diff)
+            self.logger.info(f"Incremental review of {len(review_diff.files)} files changed since the last reviewed head")
+        else:
+            previous_review = ""
+        db_payload["review_mode"] = "incremental" if previous_review else "full"
 
         # Get Prompt
-        question = self._get_prompt(jira_ticket_detail, base_ref, repo_name, git_diff_content)
-        self.logger.info("Prompt for AI review generated.")
-        self.logger.info(f"AI Review Prompt: {question}")
-        
-        # Get Review from AI
-        system_prompt = None
-        review_result = self.ai_request(question=question, system_prompt=system_prompt, ai_model="VIO:Gemini 2.5 Pro")
+        route = model_router.select(self.project, review_diff)
+        endpoint = route["endpoint"]
+        ai_model = route["model"] or (self.local_ai_model_name if endpoint == "local" else self.ai_model_name)
+        db_payload["ai_route"] = route["name"]
+        db_payload["ai_model"] = ai_model
+        db_payload["ai_endpoint"] = endpoint
+        rules_text = self._build_rules_prompt(language="zh")
+        # Same change, Jira, target branch, prompt template and model -> same review
+        cache_parts = [normalize_diff(git_diff_content), jira_ticket_detail, base_ref, rules_text, self._get_prompt_version(), ai_model]
+        if previous_review:
+            # 增量审查的结果还取决于上一次审查和增量 diff，不能与全量审查共用缓存
+            cache_parts += ["incremental", previous_review, normalize_diff(incremental_diff)]
+        cache_key = review_cache.make_key(*cache_parts)
+        cached = review_cache.get(cache_key)
+        if cached and cached["post_check_score"] is None:
+            cached = None  # 旧版本缓存的未评分审查，重新审查并评分
+        question = ""
+        review_prompt = ""
+        dropped_sections = []
+        if cached:
+            self.logger.info(f"AI review cache hit {cache_key[:12]}, skip AI request")
+            db_payload["review_mode"] = "cached"
+            review_result = cached["review"]
+        else:
+            budget = get_token_budget(ai_model)
+            if previous_review:
+                budget -= estimate_tokens(self._get_incremental_prompt(previous_review, ""))
+            instruction_tokens = estimate_tokens(self._get_instructions(base_ref, repo_name))
+            # diff 本身超出模型上下文时按文件分组审查，否则按优先级裁剪 Jira/规则
+            sharded = bool(review_diff.files) and instruction_tokens + estimate_tokens(review_diff.text) > budget
+            if sharded and previous_review:
+                # 分组审查不支持增量：增量 diff 仍超出预算时放弃上一次结果，整个 PR 按文件分组重新审查
+                self.logger.info("Incremental diff exceeds the token budget, run a full sharded review without the previous review")
+                previous_review = ""
+            if not sharded:
+                question, dropped_sections = self._pack_prompt(jira_ticket_detail, base_ref, repo_name, review_diff, rules_text, budget)
+                if previous_review:
+                    question = self._get_incremental_prompt(previous_review, question)
+                self.logger.info("Prompt for AI review generated.")
+                self.logger.info(f"AI Review Prompt: {len(question)} chars, {len(review_diff.files)} diff files")
+
+            # Get Review from AI
+            self._check_superseded()
+            # 静态指令作为 system prompt，每次请求字节一致，便于服务端前缀缓存
+            system_prompt = self._get_system_prompt()
+            ai_start = time.monotonic()
+            try:
+                if sharded:
+                    db_payload["review_mode"] = "sharded"
+                    review_result, question = self._ai_pr_review_sharded(pr_diff, jira_ticket_detail, base_ref, repo_name, ai_model, rules_text, dropped_sections, endpoint=endpoint)
+                elif REVIEW_STREAM:
+                    # 先发占位评论，生成过程中按节流间隔更新，缩短开发者等待首个反馈的时间
+                    self._previous_review_body = (self.get_my_review_comment() or {}).get("body", "")
+                    self._publish_review_progress("", language)
+                    try:
+                        review_result = self.ai_request_stream(
+                            question=question, system_prompt=system_prompt, ai_model=ai_model, endpoint=endpoint,
+                            on_progress=lambda text: self._publish_review_progress(text, language)
+                        )
+                    except ReviewSuperseded:
+                        raise
+                    except Exception as e:
+                        # 占位评论已覆盖上一次审查结果，失败时以空结果返回，由标准失败说明替换占位评论
+                        self.logger.error(f"AI streaming review failed: {e}", exc_info=True)
+                        review_result = ""
+                else:
+                    review_result = self.ai_request(question=question, system_prompt=system_prompt, ai_model=ai_model, endpoint=endpoint)
+            except AdmissionTimeout as e:
+                # 排队超时同样以空结果返回，回复标准失败说明
+                self.logger.error(f"AI review was not admitted: {e}")
+                review_result = ""
+            db_payload["ai_latency"] = round(time.monotonic() - ai_start, 3)
+            model_router.record(route["name"], db_payload["ai_latency"])
+            review_prompt = f"{system_prompt}\n\n{question}"
+            self.logger.info(f"AI review via route '{route['name']}' ({ai_model}@{endpoint}) took {db_payload['ai_latency']}s")
+        db_payload["prompt_dropped_sections"] = dropped_sections
         review_result = review_result.strip()
+        ai_review = review_result
         jira_link = f"{self.jira_root_url}browse/{jira_ticket_id}" if jira_ticket_id else ""
         self.logger.info("AI review result received.")
         self.logger.info(f"AI Review Result: {review_result}")
@@ -235,14 +497,39 @@ class AICodeReviewOrchestrator:
                 setup_watchdog(success=True, project=self.project, jira_link=jira_link, pr_url=pr_url)
 
                 # DVAF-119 Reviwe评分 --> AI Post Check 
-                score, reason = self._ai_post_check(
-                    prompt=question, 
-                    review_result=review_result, 
-                    language='zh'
-                )
-
-                review_result = review_result + '\n---\n\n' + f'*AI Post Check*\nScore: {score}\nReason: {reason}'
+                score, reason = None, None
+                if cached:
+                    score, reason = cached["post_check_score"], cached["post_check_reason"]
+                elif random.random() >= POST_CHECK_SAMPLE_RATE:
+                    # 未评分的审查不写入缓存，否则之后的命中都会跳过 post check
+                    self.logger.info("AI post check skipped by sampling.")
+                elif POST_CHECK_ASYNC:
+                    # 评论先发布，评分在后台完成后再更新评论与数据库
+                    self._pending_post_check = {
+                        "prompt": review_prompt,
+                        "review_result": review_result,
+                        "cache_key": cache_key,
+                        "ai_review": ai_review,
+                        "ai_model": ai_model,
+                    }
+                else:
+                    score, reason = self._ai_post_check(
+                        prompt=review_prompt, 
+                        review_result=review_result, 
+                        language='zh'
+                    )
+                    if score is not None:
+                        review_cache.put(cache_key, ai_review, score, reason, model=ai_model)
+
+                if score is not None:
+                    db_payload["ai_post_check_score"] = score
+                    db_payload["ai_post_check_reason"] = reason
+                    review_result = review_result + self._get_post_check_result(score, reason)
         
+        db_payload["prompt_version"] = self._get_prompt_version()
+        db_payload["prompt_templates"] = prompt_registry.versions(REVIEW_TEMPLATES, self.template_group)
+        db_payload.update(self._get_usage_columns(self.ai_usage))
+        self.logger.info(f"AI usage: {db_payload['ai_calls']} calls, {db_payload['ai_prompt_tokens']} prompt / {db_payload['ai_completion_tokens']} completion tokens")
         self.logger.info("------------------Terminate RevBot------------------")
 
         error_pattern = re.compile(r"^Error: data:|Error: Response generation timed out|^VIO API request exception:")
@@ -254,11 +541,80 @@ class AICodeReviewOrchestrator:
                 return "*Review message from AI:*\n\nI'm sorry, but I cannot review this change due to excessive context (PR changes and comments) or network issues."
         else:
             review_result = "*Review message from AI:*\n\n" + review_result + "\n\n*Any question, you can ask me with 'AI' in your comment or @me.*"
+            if db_payload.get("ai_risk_level"):
+                review_result += self._get_review_marker(head_sha=self.head_sha, patch_id=pr_diff.patch_id())
 
         return review_result
 
 
 
+    def _get_usage_columns(self, usage):
+        """
+        db_payload columns of the AI calls in `usage`, i.e. of the latest review of the PR.
+        Every call is also stored in AI_USAGE_TABLE, see `usage_install`.
+        """
+        prompt_tokens = sum(u["prompt_tokens"] for u in usage)
+        completion_tokens = sum(u["completion_tokens"] for u in usage)
+        cached_tokens = sum(u.get("cached_tokens", 0) for u in usage)
+        return {
+            "ai_calls": len(usage),
+            "ai_retries": sum(u["retries"] for u in usage),
+            "ai_prompt_tokens": prompt_tokens,
+            "ai_completion_tokens": completion_tokens,
+            "ai_cached_tokens": cached_tokens,
+            "ai_cache_hit_rate": round(cached_tokens / prompt_tokens, 3) if prompt_tokens else 0.0,
+            "ai_usage": list(usage),
+        }
+
+    def _get_post_check_result(self, score, reason):
+        return '\n---\n\n' + f'*AI Post Check*\nScore: {score}\nReason: {reason}'
+
+    def start_post_check(self, html_url):
+        """
+        Run the deferred post check in the background, then add the score to the review comment and DB row.
+        """
+        pending = self._pending_post_check
+        self._pending_post_check = None
+        if not pending:
+            return None
+        t = threading.Thread(target=self._run_post_check, args=(pending, html_url), name=f"revbot-post-check-{self.pr_number}", daemon=True)
+        t.start()
+        return t
+
+    def _run_post_check(self, pending, html_url):
+        try:
+            usage_start = len(self.ai_usage)
+            score, reason = self._ai_post_check(
+                prompt=pending["prompt"], 
+                review_result=pending["review_result"], 
+                language='zh'
+            )
+            self.usage_install(html_url, self.ai_usage[usage_start:], prompt_version=self._get_prompt_version())
+            if score is None:
+                return
+            review_cache.put(pending["cache_key"], pending["ai_review"], score, reason, model=pending["ai_model"])
+
+            if pr_coalescer.is_superseded(self.pr_key, self.head_sha):
+                self.logger.info(f"Head {self.head_sha} is no longer current, drop AI post check result")
+                return
+
+            # 重新获取评论，确认仍是本次审查结果后再更新
+            self._my_review_comment = None
+            body = (self.get_my_review_comment() or {}).get("body", "")
+            if pending["review_result"] not in body:
+                self.logger.info("Review comment changed since the review, drop AI post check result")
+                return
+            post_check = self._get_post_check_result(score, reason)
+            self.create_ai_review_comment(body.replace(pending["review_result"], pending["review_result"] + post_check, 1))
+            self.db_payload_install({
+                "html_url": html_url,
+                "ai_post_check_score": score,
+                "ai_post_check_reason": reason,
+            })
+            self.logger.info(f"AI post check added to review comment: {score}")
+        except Exception as e:
+            self.logger.error(f"Background AI post check failed: {e}", exc_info=True)
+
     def _ai_post_check(self, prompt, review_result, language):
         self.logger.info("------------------Start AI Post Review------------------")
 
@@ -272,26 +628,7 @@ class AICodeReviewOrchestrator:
         )
 
 
-        if language == "zh":
-            question = (
-                f"你是一个代码审核机器人，接下来我将提供一个输入给其他AI模型的Prompt：\n"
-                f"{prompt}\n"
-                f"以及其他AI返回的结果：\n"
-                f"{review_result}\n"
-                f"请评估该代码审核结果的准确性，指出是否存在明显错误。\n"
-                f"请返回评分（0-100分）及简短理由。\n"
-                f"请按以下格式返回：分数，理由。请不要添加其他内容。"
-            )
-        else:
-            question = (
-                f"You are a code review assistant. Below is a prompt provided to another AI model:\n"
-                f"{prompt}\n"
-                f"and the response received from the other AI:\n"
-                f"{review_result}\n"
-                f"Please assess the accuracy of the code review result and identify any obvious errors.\n"
-                f"Return a score (0-100) along with a brief explanation.\n"
-                f"Please respond in the following format: (score, explanation). Do not include anything else."
-            )
+        question = prompt_registry.render("post_check", self.template_group, language, prompt=prompt, review_result=review_result)
 
         def parse_result(result):
             result = result.strip()
@@ -328,6 +665,7 @@ class AICodeReviewOrchestrator:
                     self.logger.error("❌ AI Post Check failed!")
                     break
 
+        self.ai_usage.extend(dict(u, purpose="post_check") for u in ai.usage)
         self.logger.info("------------------Terminate AI Post Review------------------")
 
         return score, reason
@@ -347,20 +685,22 @@ class AICodeReviewOrchestrator:
             out_path = os.path.join(out_dir, f"{owner}_{repo}_{pr_number}.txt")
             self.logger.info(f"Saving history to {out_path}")
             if ticket_detail:
-                rag_text = (
+                rag_header = (
                     "# 该次变更已合入主分支，以下为变更历史：\n\n"
                     f"# 该次代码提交关联的Jira ticket：{jira_ticket}\n\n"
                     f"# 该次代码提交的Jira需求：\n{ticket_detail}\n\n"
-                    f"# 该次代码提交的PR Git Diff（以下仅列出仓库 {repo} 的变更内容）：\n{diff_content}"
+                    f"# 该次代码提交的PR Git Diff（以下仅列出仓库 {repo} 的变更内容）：\n"
                 )
             else:
-                rag_text = (
+                rag_header = (
                     "# 该次变更已合入主分支，以下为变更历史：\n\n"
                     f"# 该次代码提交关联的Jira ticket：{jira_ticket}\n\n"
-                    f"# 该次代码提交的PR Git Diff（以下仅列出仓库 {repo} 的变更内容）：\n{diff_content}"
+                    f"# 该次代码提交的PR Git Diff（以下仅列出仓库 {repo} 的变更内容）：\n"
                 )
+            # diff 直接从解析后的缓冲区写入，不再拼接完整副本
             with open(out_path, "w", encoding="utf-8") as f:
-                f.write(rag_text)
+                f.write(rag_header)
+                f.write(self._get_pr_diff_model(diff_content).render())
         except Exception as e:
             print(f"format_history_for_rag exception: {e}")
             return
@@ -375,7 +715,7 @@ class AICodeReviewOrchestrator:
         headers = {"Authorization": f"token {github_token}"}
         codeowners_url = f"{repo_url}/contents/.github/CODEOWNERS?ref={base_ref}"
         try:
-            resp = requests.get(codeowners_url, headers=headers, timeout=30)
+            resp = self.github.get(codeowners_url, headers=headers, timeout=30)
             resp.raise_for_status()
         except Exception as e:
             print(f"Failed to fetch CODEOWNERS file: {e}")
@@ -404,7 +744,7 @@ class AICodeReviewOrchestrator:
         team_url = f"{org_url}/teams/{team}/members"
         headers = {"Authorization": f"token {github_token}"}
         try:
-            resp = requests.get(team_url, headers=headers, timeout=30)
+            resp = self.github.get(team_url, headers=headers, timeout=30)
             resp.raise_for_status()
         except Exception as e:
             print(f"Failed to fetch team members: {e}")
@@ -424,7 +764,7 @@ class AICodeReviewOrchestrator:
         reviews_url = f"{repo_url}/pulls/{number}/reviews"
         headers = {"Authorization": f"token {github_token}"}
         try:
-            resp = requests.get(reviews_url, headers=headers, timeout=30)
+            resp = self.github.get(reviews_url, headers=headers, timeout=30)
             resp.raise_for_status()
         except Exception as e:
             print(f"Failed to fetch reviews: {e}")
@@ -465,7 +805,7 @@ class AICodeReviewOrchestrator:
         diff_url = f"{repo_url}/pulls/{number}.diff"
         headers = {"Authorization": f"token {github_token}", "Accept": "application/vnd.github.v3.diff"}
         try:
-            resp = requests.get(diff_url, headers=headers, timeout=60)
+            resp = self.github.get(diff_url, headers=headers, timeout=60)
             resp.raise_for_status()
         except Exception as e:
             print(f"Failed to fetch PR diff: {e}")
@@ -475,7 +815,12 @@ class AICodeReviewOrchestrator:
                 return "The PR has too many changes or network issues prevent fetching changes"
         return resp.text
 
-    def get_changes_list(self):
+    def get_changes_list(self, git_diff_content=""):
+        # 优先从已下载的 diff 中解析，避免额外的 API 请求
+        if git_diff_content:
+            self.changed_files_detail = self._get_pr_diff_model(git_diff_content).changed_files()
+            if self.changed_files_detail:
+                return [f["filename"] for f in self.changed_files_detail]
         github_token = self.github_token
         repo_url = self.request.json.get("repository", {}).get("url", "")
         if not github_token or not repo_url:
@@ -488,15 +833,32 @@ class AICodeReviewOrchestrator:
             if not number:
                 print("Missing pull self.request number")
                 return []
-        files_url = f"{repo_url}/pulls/{number}/files"
         headers = {"Authorization": f"token {github_token}"}
-        try:
-            resp = requests.get(files_url, headers=headers, timeout=60)
-            resp.raise_for_status()
-        except Exception as e:
-            print(f"Failed to fetch PR changed files: {e}")
-            return []
-        files = resp.json()
+        files = []
+        page = 1
+        while True:
+            files_url = f"{repo_url}/pulls/{number}/files?per_page=100&page={page}"
+            try:
+                resp = self.github.get(files_url, headers=headers, timeout=60)
+                resp.raise_for_status()
+            except Exception as e:
+                print(f"Failed to fetch PR changed files: {e}")
+                return []
+            page_files = resp.json()
+            files.extend(page_files)
+            if len(page_files) < 100:
+                break
+            page += 1
+        self.changed_files_detail = [
+            {
+                "filename": f.get("filename", ""),
+                "previous_filename": f.get("previous_filename", ""),
+                "status": f.get("status", ""),
+                "additions": f.get("additions", 0),
+                "deletions": f.get("deletions", 0),
+            }
+            for f in files
+        ]
         changed_files = [f.get("filename", "") for f in files]
         return changed_files
 
@@ -514,7 +876,7 @@ class AICodeReviewOrchestrator:
             "Authorization": f"token {github_token}"
         }
         try:
-            resp = requests.get(pulls_url, headers=headers, timeout=30)
+            resp = self.github.get(pulls_url, headers=headers, timeout=30)
             resp.raise_for_status()
             pulls = resp.json()
             if pulls and isinstance(pulls, list):
@@ -555,24 +917,161 @@ class AICodeReviewOrchestrator:
         db_payload["jira_labels"] = fields.get("labels", [])
         return jira_ticket_detail
 
-    def ai_request(self, question="", system_prompt=None, ai_model="VIO:Gemini 2.5 Pro"):
-        try:
-            client = openai.OpenAI(
-                api_key=self.ai_token,
-                base_url=self.ai_url,
-                http_client=httpx.Client(verify=False)
-            )
-        except Exception as e:
-            return f"VIO API client initialization exception: {e}"
+    def _get_ai_endpoint(self, endpoint="vio"):
+        """
+        (base_url, api keys, verify) of an AI endpoint, "vio" or "local".
+        """
+        if endpoint == "local":
+            return self.local_ai_base_url, [self.local_ai_api_key], True
+        return self.ai_url, self.ai_token.split(","), False
+
+    def ai_request(self, question="", system_prompt=None, ai_model="VIO:Gemini 2.5 Pro", endpoint="vio", purpose="review"):
+        base_url, api_keys, verify = self._get_ai_endpoint(endpoint)
         messages = []
         if system_prompt:
             messages.append({"role": "system", "content": system_prompt})
         messages.append({"role": "user", "content": question})
-        response = client.chat.completions.create(
-            model=ai_model,
-            messages=messages
+        # 多个 key 时跳过熔断中的 key，失败立即切换下一个
+        last_error = None
+        prompt_tokens = estimate_tokens(question) + estimate_tokens(system_prompt or "")
+        for retries, api_key in enumerate(vio_keys.candidates(api_keys, include_open=True)):
+            with ai_admission.slot(base_url, api_key, prompt_tokens):
+                started = vio_keys.begin(api_key)
+                try:
+                    client = ai_clients.get(base_url, api_key, verify=verify)
+                    response = client.chat.completions.create(
+                        model=ai_model,
+                        messages=messages
+                    )
+                except Exception as e:
+                    if not vio_keys.failure(api_key, started, e):
+                        self.logger.error(f"VIO API request rejected, not retried with other keys: {e}")
+                        raise
+                    self.logger.error(f"VIO API error with API key ...{api_key[-4:]}: {e}")
+                    last_error = e
+                    continue
+            vio_keys.success(api_key, started)
+            answer = response.choices[0].message.content
+            self.ai_usage.append(make_usage_record(response, ai_model, endpoint, api_key, time.monotonic() - started,
+                                                   retries=retries, messages=messages, answer=answer, purpose=purpose))
+            return answer
+        if last_error is None:
+            return "VIO API client initialization exception: no API key configured"
+        raise last_error
+
+    def ai_request_stream(self, question="", system_prompt=None, ai_model="VIO:Gemini 2.5 Pro", on_progress=None, endpoint="vio", purpose="review"):
+        """
+        Streaming variant of ai_request. `on_progress(text)` receives the text generated so far, cut at
+        the last complete line, at most every REVIEW_STREAM_INTERVAL seconds or REVIEW_STREAM_TOKENS new tokens.
+        Falls back to ai_request when the stream fails before any content arrived.
+        """
+        parts = []
+        error = None
+        base_url, api_keys, verify = self._get_ai_endpoint(endpoint)
+        api_key = (vio_keys.candidates(api_keys, include_open=True) or [""])[0]
+        prompt_tokens = estimate_tokens(question) + estimate_tokens(system_prompt or "")
+        with ai_admission.slot(base_url, api_key, prompt_tokens):
+            started = vio_keys.begin(api_key)
+            try:
+                client = ai_clients.get(base_url, api_key, verify=verify)
+                messages = []
+                if system_prompt:
+                    messages.append({"role": "system", "content": system_prompt})
+                messages.append({"role": "user", "content": question})
+                stream = client.chat.completions.create(
+                    model=ai_model,
+                    messages=messages,
+                    stream=True,
+                    stream_options={"include_usage": True}  # 最后一个 chunk 带 usage（含 cached_tokens）
+                )
+
+                published = 0
+                pending_tokens = 0
+                last_publish = time.monotonic()
+                usage_chunk = None
+                try:
+                    for chunk in stream:
+                        if getattr(chunk, "usage", None):
+                            usage_chunk = chunk
+                        if not chunk.choices:
+                            continue
+                        delta = chunk.choices[0].delta.content
+                        if not delta:
+                            continue
+                        parts.append(delta)
+                        pending_tokens += estimate_tokens(delta)
+
+                        now = time.monotonic()
+                        if on_progress and (now - last_publish >= REVIEW_STREAM_INTERVAL or pending_tokens >= REVIEW_STREAM_TOKENS):
+                            text = "".join(parts)
+                            cut = text.rfind("\n") + 1
+                            if cut > published:
+                                on_progress(text[:cut])
+                                published = cut
+                                pending_tokens = 0
+                                last_publish = now
+                finally:
+                    stream.close()  # superseded or failed streams must not keep the pooled connection
+
+            except ReviewSuperseded:
+                vio_keys.cancel(api_key)
+                raise
+            except Exception as e:
+                vio_keys.failure(api_key, started, e)
+                if parts:
+                    raise
+                error = e
+
+        # 在释放准入名额之后再降级为非流式请求
+        if error is not None:
+            self.logger.warning(f"AI streaming request failed, retry without streaming: {error}")
+            return self.ai_request(question=question, system_prompt=system_prompt, ai_model=ai_model, endpoint=endpoint, purpose=purpose)
+
+        vio_keys.success(api_key, started)
+        answer = "".join(parts)
+        self.ai_usage.append(make_usage_record(usage_chunk, ai_model, endpoint, api_key, time.monotonic() - started,
+                                               messages=messages, answer=answer, purpose=purpose))
+        return answer
+
+    def _get_progress_review_result(self, partial_review, language="zh"):
+        if language == "zh":
+            status = "*AI 正在审查本次改动，内容会持续更新...*"
+        else:
+            status = "*AI is reviewing this change, this comment keeps updating...*"
+        # 保留上一次审查的标记，被新提交取代时增量审查和 patch id 跳过仍然可用
+        marker = REVIEW_MARKER_PATTERN.search(self._previous_review_body)
+        return "*Review message from AI:*\n\n" + status + ("\n\n" + partial_review if partial_review else "") + (marker.group(0) if marker else "")
+
+    def _publish_review_progress(self, partial_review, language="zh"):
+        self._check_superseded()
+        self._progress_body = self._get_progress_review_result(partial_review, language)
+        self.create_ai_review_comment(self._progress_body)
+
+    def restore_previous_review(self):
+        """
+        Put the previous review back after a superseded streaming review, unless the comment changed since
+        the last progress update (e.g. the newer event already posted its own).
+        """
+        if not self._progress_body or not self._previous_review_body:
+            return
+        self._my_review_comment = None
+        if (self.get_my_review_comment() or {}).get("body") != self._progress_body:
+            return
+        self.create_ai_review_comment(self._previous_review_body)
+        self.logger.info("Restored the previous review comment of the superseded review")
+
+    def _get_reply_prompt(self, user_name, review_comments, title, repo_name, git_diff_content, language="zh"):
+        now = datetime.utcnow() + timedelta(hours=8)  # Shanghai Time
+        return prompt_registry.render(
+            "reply", self.template_group, language,
+            user_name=user_name,
+            review_comments=review_comments,
+            now=now.strftime('%Y-%m-%d %H:%M:%S'),
+            week=now.isocalendar()[1],
+            title=title,
+            repo_name=repo_name,
+            diff=git_diff_content,
         )
-        return response.choices[0].message.content
 
     def ai_pr_reply(self, user_name="", git_diff_content="", review_comments="", language="zh"): # TODO
         repo_name = self.request.json.get("repository", {}).get("name", "")
@@ -586,39 +1085,23 @@ class AICodeReviewOrchestrator:
                     title = "无PR标题"
                 else:
                     title = "No PR Title"
-        if len(git_diff_content) > 300000:
-            git_diff_content = git_diff_content[:300000] + "\n...\n*The diff content is too long, has been truncated.*"
-        # 优化后的AI提示词
-        if language == "zh":
-            question = f"""# 目标 (Goal)
-用户{user_name}基于你的代码审查意见进行了回复，请你基于以下信息回答该用户，保持专业、客观、友好的语气和称谓。除非用户指出回复语言，否则使用中文回复。
-
-# 该用户评论以及评论历史 (User Comment and History)
-{review_comments}
-
-# 上下文信息 (Contextual Information)
-1. 当前时间日期为 {(datetime.utcnow() + timedelta(hours=8)).strftime('%Y-%m-%d %H:%M:%S')} Shanghai Time，当前为第 {(datetime.utcnow() + timedelta(hours=8)).isocalendar()[1]} 周。
-2. **该PR的标题**
-{title}
-3.  **该PR的具体改动(Git Diff)，仅列出仓库 {repo_name} 的变更内容**:
-{git_diff_content}
-"""
-        else:
-            question = f"""# Goal
-The user {user_name} has replied to your code review comments. Please respond to the user based on the information below, maintaining a professional, objective, and friendly tone and salutation. Unless the user specifies a reply language, respond in English.
-
-# User Comment and History
-{review_comments}
-
-# Contextual Information
-1. Current date and time: {(datetime.utcnow() + timedelta(hours=8)).strftime('%Y-%m-%d %H:%M:%S')} Shanghai Time, week {(datetime.utcnow() + timedelta(hours=8)).isocalendar()[1]}.
-2. **PR Title**
-{title}
-3. **Specific changes (Git Diff), only for repository {repo_name}:**
-{git_diff_content}
-"""
+        # 超长 diff 在文件/hunk 边界截断，再按 token 预算裁剪评论历史和 diff
+        pr_diff = self._get_pr_diff_model(git_diff_content)
+        route = model_router.select(self.project, pr_diff)
+        ai_model = route["model"] or (self.local_ai_model_name if route["endpoint"] == "local" else self.ai_model_name)
+        git_diff_content = pr_diff.render(max_chars=300000, truncation_note=DIFF_TRUNCATION_NOTE)
+        packer = ContextPacker(get_token_budget(ai_model))
+        packer.add("instructions", self._get_reply_prompt(user_name, "", title, repo_name, "", language), priority=0, required=True)
+        packer.add("diff", git_diff_content, priority=1, trimmer=lambda text, max_tokens: self._trim_diff(pr_diff, None, text, max_tokens))
+        packer.add("history", review_comments, priority=4, trimmer=trim_tail)
+        packed = packer.pack()
+        if packer.dropped:
+            self.logger.warning(f"Reply prompt over budget, trimmed sections: {packer.dropped}")
+        question = self._get_reply_prompt(user_name, packed["history"], title, repo_name, packed["diff"], language)
         system_prompt = None
-        review_result = self.ai_request(question=question, system_prompt=system_prompt, ai_model="VIO:Gemini 2.5 Pro")
+        ai_start = time.monotonic()
+        review_result = self.ai_request(question=question, system_prompt=system_prompt, ai_model=ai_model, endpoint=route["endpoint"], purpose="reply")
+        model_router.record(route["name"], time.monotonic() - ai_start)
         review_result = review_result.strip()
         error_pattern = re.compile(r"^Error: data:|Error: Response generation timed out|^VIO API self.request exception:")
         if re.search(error_pattern, review_result):
@@ -629,50 +1112,143 @@ The user {user_name} has replied to your code review comments. Please respond to
                 return "I'm sorry, but I cannot reply to your comment due to excessive context (PR changes and comments) or network issues."
         return review_result
 
-    def create_ai_review_comment(self, review_result):
+    def get_my_review_comment(self):
+        """
+        Return the bot's review comment of this PR ({} if there is none, None if the lookup failed).
+        Fetched once per event and reused by incremental review and comment update.
+        """
+        if self._my_review_comment is not None:
+            return self._my_review_comment
         repo_url = self.request.json.get("repository", {}).get("url", "")
         pr_number = self.request.json.get('pull_request', {}).get("number", 0)
         github_token = self.github_token
         if not repo_url or not pr_number or not github_token or not self.github_username:
             print("Missing repo_url, pr_number, or github_token or github_username")
-            return False
+            return None
         comments_url = f"{repo_url}/issues/{pr_number}/comments"
         headers = {
             "Accept": "application/vnd.github.v3+json",
             "Authorization": f"token {github_token}"
         }
         try:
-            resp = requests.get(comments_url, headers=headers, timeout=60)
+            resp = self.github.get(comments_url, headers=headers, timeout=60)
             resp.raise_for_status()
         except Exception as e:
             print(f"Failed to fetch PR comments: {e}")
-            return False
+            return None
         comments = resp.json()
-        my_comment = None
+        my_comment = {}
         for c in comments:
             if c.get("user", {}).get("login", "").lower() == self.github_username.lower():
                 my_comment = c
                 break
+        self._my_review_comment = my_comment
+        return my_comment
+
+    def get_incremental_diff(self):
+        """
+        Return (previous review, diff since the last reviewed head). Both are empty when the
+        last review is unknown, the new head is not a fast-forward of it (force-push/rebase), or the
+        new commits contain a merge: the compare diff would then include the merged base changes,
+        which are not part of the PR, so the PR gets a full review against its merge base instead.
+        """
+        my_comment = self.get_my_review_comment()
+        if not my_comment:
+            return "", ""
+        last_sha = self._parse_review_marker(my_comment.get("body", "")).get("head_sha", "")
+        repo_url = self.request.json.get("repository", {}).get("url", "")
+        if not last_sha or not self.head_sha or last_sha == self.head_sha or not repo_url:
+            return "", ""
+        compare_url = f"{repo_url}/compare/{last_sha}...{self.head_sha}"
+        headers = {"Authorization": f"token {self.github_token}"}
+        try:
+            resp = self.github.get(compare_url, headers=dict(headers, Accept="application/vnd.github.v3+json"), timeout=30)
+            resp.raise_for_status()
+            compare = resp.json()
+            status = compare.get("status", "")
+            if status != "ahead":
+                self.logger.info(f"Head {self.head_sha} is {status} of last reviewed {last_sha}, run full review")
+                return "", ""
+            commits = compare.get("commits", [])
+            if len(commits) < compare.get("total_commits", 0) or any(len(c.get("parents", [])) > 1 for c in commits):
+                self.logger.info(f"Commits since last reviewed {last_sha} include a merge (base moved), run full review")
+                return "", ""
+            resp = self.github.get(compare_url, headers=dict(headers, Accept="application/vnd.github.v3.diff"), timeout=60)
+            resp.raise_for_status()
+        except Exception as e:
+            print(f"Failed to fetch incremental diff: {e}")
+            return "", ""
+        previous_review = CARRY_OVER_PATTERN.sub("", REVIEW_MARKER_PATTERN.sub("", my_comment.get("body", "")))
+        return previous_review, resp.text
+
+    def skip_same_patch_review(self, git_diff_content, db_payload, language="zh"):
+        """
+        Rebase without content change: the new head has the same patch id as the last reviewed one.
+        Keep the review, note that it was carried over to the new head and move the comment marker.
+        Return True when skipped.
+        """
+        my_comment = self.get_my_review_comment()
+        if not my_comment:
+            return False
+        body = my_comment.get("body", "")
+        marker = self._parse_review_marker(body)
+        patch_id = self._get_pr_diff_model(git_diff_content).patch_id()
+        if not patch_id or marker.get("patch_id") != patch_id or marker.get("head_sha") == self.head_sha:
+            return False
+
+        reviewed_sha = marker.get("reviewed_sha") or marker.get("head_sha", "")  # 多次 rebase 时保留实际审查的提交
+        skipped = review_stats.record_patch_skip()
+        self.logger.info(f"Head {self.head_sha} has the same patch id as reviewed head {reviewed_sha}, skip AI review ({skipped} reviews skipped)")
+        db_payload["review_mode"] = "skipped_same_patch"
+        if language == "zh":
+            note = f"*提交 {self.head_sha[:7]} 与已审查的提交 {reviewed_sha[:7]} 改动内容相同，沿用以上审查结果。*"
+        else:
+            note = f"*Commit {self.head_sha[:7]} has the same changes as the reviewed commit {reviewed_sha[:7]}, the review above is carried over.*"
+        body = CARRY_OVER_PATTERN.sub("", REVIEW_MARKER_PATTERN.sub("", body))
+        body += f"\n\n{note} <!-- RevBot carried over -->" + self._get_review_marker(head_sha=self.head_sha, patch_id=patch_id, reviewed_sha=reviewed_sha)
+        self.create_ai_review_comment(body)
+        return True
+
+    def create_ai_review_comment(self, review_result):
+        """
+        Create or update the bot's review comment. Return the comment id, False on failure.
+        """
+        repo_url = self.request.json.get("repository", {}).get("url", "")
+        pr_number = self.request.json.get('pull_request', {}).get("number", 0)
+        github_token = self.github_token
+        if not repo_url or not pr_number or not github_token or not self.github_username:
+            print("Missing repo_url, pr_number, or github_token or github_username")
+            return False
+        comments_url = f"{repo_url}/issues/{pr_number}/comments"
+        headers = {
+            "Accept": "application/vnd.github.v3+json",
+            "Authorization": f"token {github_token}"
+        }
+        my_comment = self.get_my_review_comment()
+        if my_comment is None:
+            return False
         body = review_result
         if my_comment:
             comment_id = my_comment["id"]
             patch_url = f"{repo_url}/issues/comments/{comment_id}"
             patch_data = {"body": body}
             try:
-                patch_resp = requests.patch(patch_url, json=patch_data, headers=headers, timeout=30)
+                patch_resp = self.github.patch(patch_url, json=patch_data, headers=headers, timeout=30)
                 patch_resp.raise_for_status()
+                self._my_review_comment = patch_resp.json() or my_comment
             except Exception as e:
                 print(f"Failed to update AI review comment: {e}")
                 return False
         else:
             data = {"body": body}
             try:
-                post_resp = requests.post(comments_url, json=data, headers=headers, timeout=30)
+                post_resp = self.github.post(comments_url, json=data, headers=headers, timeout=30)
                 post_resp.raise_for_status()
+                self._my_review_comment = post_resp.json()
             except Exception as e:
                 print(f"Failed to create AI review comment: {e}")
                 return False
-        return True
+        return self._my_review_comment.get("id", True)
 
     def create_ai_reply_comment(self, reply_result):
         repo_url = self.request.json.get("repository", {}).get("url", "")
@@ -693,7 +1269,7 @@ The user {user_name} has replied to your code review comments. Please respond to
         }
         data = {"body": reply_result}
         try:
-            post_resp = requests.post(comments_url, json=data, headers=headers, timeout=30)
+            post_resp = self.github.post(comments_url, json=data, headers=headers, timeout=30)
             post_resp.raise_for_status()
             setup_watchdog(success=True, project=self.project, jira_link='', pr_url=comments_url)
         except Exception as e:
@@ -720,7 +1296,7 @@ The user {user_name} has replied to your code review comments. Please respond to
             "Authorization": f"token {github_token}"
         }
         try:
-            resp = requests.get(comments_url, headers=headers, timeout=60)
+            resp = self.github.get(comments_url, headers=headers, timeout=60)
             resp.raise_for_status()
         except Exception as e:
             print(f"Failed to fetch PR comments: {e}")
@@ -766,9 +1342,13 @@ The user {user_name} has replied to your code review comments. Please respond to
                 # 自动填充 last_edit 字段（带东八区时区信息，避免 Django warning）
                 if pk and not db_payload.get('last_edit'):
                     db_payload['last_edit'] = datetime.now(timezone(timedelta(hours=8)))
+                table_columns = self._get_table_columns(cur)
                 columns = []
                 values = []
                 for k, v in db_payload.items():
+                    # 跳过表中尚不存在的新字段（未执行 tools/db_migrate.py 时）
+                    if table_columns and k not in table_columns:
+                        continue
                     if v is not None and k != 'html_url':
                         # 如果是 dict 或 list，序列化为 JSON 字符串
                         if isinstance(v, (dict, list)):
@@ -798,7 +1378,55 @@ The user {user_name} has replied to your code review comments. Please respond to
             if conn:
                 self._db_pool.putconn(conn)
 
-    def db_payload_install(self, db_payload):
+    def _get_table_columns(self, cur):
+        """
+        Column names of db_sheet_name, empty when they cannot be read (nothing is skipped then).
+        """
+        columns = AICodeReviewOrchestrator._table_columns.get(self.db_sheet_name)
+        if columns is None:
+            cur.execute("SELECT column_name FROM information_schema.columns WHERE table_name = %s", (self.db_sheet_name,))
+            columns = {row[0] for row in cur.fetchall()}
+            AICodeReviewOrchestrator._table_columns[self.db_sheet_name] = columns
+            missing = [col for col in REVIEW_COLUMNS if col not in columns]
+            if columns and missing:
+                self.logger.warning(f"Table {self.db_sheet_name} has no columns {missing}, they are not stored until tools/db_migrate.py is run")
+        return columns
+
+    def write_usage_to_db(self, html_url, usage, prompt_version=None):
+        """
+        Insert one AI_USAGE_TABLE row per AI call in `usage` (make_usage_record() dicts).
+        """
+        conn = None
+        try:
+            conn = self._db_pool.getconn()
+            with conn.cursor() as cur:
+                if not AICodeReviewOrchestrator._usage_table_ready:
+                    cur.execute(USAGE_TABLE_DDL)
+                    conn.commit()
+                    AICodeReviewOrchestrator._usage_table_ready = True
+                pr_number = self.pr_number or self.request.json.get("issue", {}).get("number") or None
+                rows = [(
+                    html_url, self.project, self.repo_name, pr_number, self.head_sha or None,
+                    u.get("purpose", ""), u["model"], u["endpoint"], u["key"],
+                    u["prompt_tokens"], u["completion_tokens"], u.get("cached_tokens", 0),
+                    u["latency"], u["retries"], u["estimated"], prompt_version,
+                    datetime.fromtimestamp(u.get("created_at") or time.time(), timezone.utc),
+                ) for u in usage]
+                cur.executemany(
+                    f"INSERT INTO {AI_USAGE_TABLE} (html_url, repository_owner_login, repository_name, pr_number, head_sha, "
+                    f"purpose, model, endpoint, api_key_suffix, prompt_tokens, completion_tokens, cached_tokens, "
+                    f"latency, retries, estimated, prompt_version, created_at) "
+                    f"VALUES ({', '.join(['%s'] * 17)})",
+                    rows
+                )
+                conn.commit()
+        except Exception as e:
+            print(f"DB usage insert error: {e}")
+        finally:
+            if conn:
+                self._db_pool.putconn(conn)
+
+    def _init_db_pool(self):
         # 使用类属性直接配置数据库
         db_config = self.db_config
 
@@ -810,9 +1438,21 @@ The user {user_name} has replied to your code review comments. Please respond to
                 **db_config
             )
 
+    def db_payload_install(self, db_payload):
+        self._init_db_pool()
+
         # 并发写入优化：使用线程池
         threading.Thread(target=self.write_to_db, args=(db_payload,)).start()
 
+    def usage_install(self, html_url, usage, prompt_version=None):
+        """
+        Record the AI calls in `usage` in the background, nothing to do when there are none.
+        """
+        if not usage or not html_url:
+            return
+        self._init_db_pool()
+        threading.Thread(target=self.write_usage_to_db, args=(html_url, list(usage), prompt_version)).start()
+
     def main(self):
         db_payload = {}
         repo_url = self.request.json.get("repository", {}).get("url", "")
@@ -967,21 +1607,41 @@ The user {user_name} has replied to your code review comments. Please respond to
                         language = "zh"
                     else:
                         language = "en"
-                git_diff_content = self.get_pr_diff(language=language)
                 head_ref = self.request.json.get('pull_request', {}).get('head', {}).get('ref', "")
                 match = re.match(r"feature/([^/]+)*", head_ref)
                 jira_ticket_id = match.group(1) if match else head_ref
+
+                # PR diff 与 Jira 详情互不依赖，并行获取
+                fetch_tasks = {"pr_diff": (self.get_pr_diff, {"language": language})}
+                if action == 'synchronize':
+                    fetch_tasks["incremental_diff"] = (self.get_incremental_diff, {})
                 if jira_ticket_id:
                     db_payload["jira_id"] = jira_ticket_id
                     db_payload["jira_link"] = f"{self.jira_root_url}browse/{jira_ticket_id}"
-                    jira_ticket_detail = self.get_jira_ticket_detail(jira_ticket_id=jira_ticket_id, db_payload=db_payload)
+                    fetch_tasks["jira_ticket_detail"] = (self.get_jira_ticket_detail, {"jira_ticket_id": jira_ticket_id, "db_payload": db_payload})
+                results = self._fetch_concurrently(fetch_tasks)
+
+                git_diff_content = results["pr_diff"]
+                previous_review, incremental_diff = results.get("incremental_diff", ("", ""))
+                if action == 'synchronize' and git_diff_content and self.skip_same_patch_review(git_diff_content, db_payload, language=language):
+                    self.db_payload_install(db_payload)
+                    return 'OK', 200
+                if jira_ticket_id:
+                    jira_ticket_detail = results["jira_ticket_detail"]
                 else:
                     if language == "zh":
                         jira_ticket_detail = "无相关Jira信息。"
                     else:
                         jira_ticket_detail = "No related Jira information."
                 if git_diff_content:
-                    review_result = self.ai_pr_review(git_diff_content=git_diff_content, db_payload=db_payload, language=language, jira_ticket_id=jira_ticket_id, jira_ticket_detail=jira_ticket_detail)
+                    try:
+                        review_result = self.ai_pr_review(git_diff_content=git_diff_content, db_payload=db_payload, language=language, jira_ticket_id=jira_ticket_id, jira_ticket_detail=jira_ticket_detail, previous_review=previous_review, incremental_diff=incremental_diff)
+                        self._check_superseded()
+                    except ReviewSuperseded as e:
+                        self.logger.info(f"Skip superseded review: {e}")
+                        self.restore_previous_review()
+                        self.usage_install(db_payload.get("html_url", ""), self.ai_usage, prompt_version=self._get_prompt_version())
+                        return 'OK', 200
                     _ = self.create_ai_review_comment(review_result)
         elif event == "issue_comment":
             if action not in ['created', 'edited']:
@@ -1002,14 +1662,21 @@ The user {user_name} has replied to your code review comments. Please respond to
                     language = "zh"
                 else:
                     language = "en"
-            git_diff_content = self.get_pr_diff(language=language)
-            review_comments = self.get_review_comments(language=language)
+            results = self._fetch_concurrently({
+                "pr_diff": (self.get_pr_diff, {"language": language}),
+                "review_comments": (self.get_review_comments, {"language": language}),
+            })
+            git_diff_content = results["pr_diff"]
+            review_comments = results["review_comments"]
             reply_result = self.ai_pr_reply(user_name=user_name, git_diff_content=git_diff_content, review_comments=review_comments, language=language)
             _ = self.create_ai_reply_comment(reply_result)
+            self.usage_install(self.request.json.get("issue", {}).get("pull_request", {}).get("html_url", ""), self.ai_usage)
             return 'OK', 200
         else:
             return 'OK', 200
         
         # 将 db_payload 存储到数据库
         self.db_payload_install(db_payload)
+        self.usage_install(db_payload.get("html_url", ""), self.ai_usage, prompt_version=db_payload.get("prompt_version"))
+        self.start_post_check(db_payload.get("html_url", ""))
         return 'OK', 200
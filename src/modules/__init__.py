@@ -1,7 +1,17 @@
-from .ai import AIPrReview
-from .github import GithubPROps
+from .ai import AIPrReview, ai_clients, vio_keys, ai_hedge, ai_admission, AdmissionTimeout, make_usage_record
+from .github import GithubPROps, github_pool
 from .jira import JiraApi
 from .sql import PostgreSQL
 from .mail import EmailSender
+from .job_queue import ReviewJobQueue
+from .coalescer import pr_coalescer, ReviewSuperseded
+from .dedup import delivery_store
+from .diff import PRDiff
+from .tokens import estimate_tokens, get_token_budget, ContextPacker, trim_tail
+from .review_cache import review_cache, normalize_diff
+from .review_stats import review_stats
+from .router import model_router
+from .prompts import prompt_registry
+from .qtools import qtools_rules
 
 from .logger import setup_logging, setup_watchdog
\ No newline at end of file
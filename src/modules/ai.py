@@ -1,7 +1,484 @@
 import openai
-from openai import InternalServerError, AuthenticationError
+import httpx
+from openai import InternalServerError, AuthenticationError, RateLimitError, APIConnectionError
 
+import time
+import atexit
 import logging
+import itertools
+import threading
+from contextlib import contextmanager
+from collections import deque, Counter
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from configs.config import AI_POOL_MAX_CONNECTIONS, AI_POOL_MAX_KEEPALIVE, AI_TIMEOUT, AI_CONNECT_TIMEOUT
+from configs.config import AI_KEY_FAILURE_THRESHOLD, AI_KEY_COOLDOWN, AI_KEY_BUDGET_COOLDOWN
+from configs.config import AI_HEDGE, AI_HEDGE_DELAY, AI_HEDGE_MIN_DELAY, AI_HEDGE_WORKERS
+from configs.config import AI_ENDPOINT_CONCURRENCY, AI_KEY_CONCURRENCY, AI_TOKENS_PER_MINUTE, AI_ADMISSION_TIMEOUT
+
+from .tokens import estimate_tokens
+
+
+VIO_DEFAULT_HEADERS = {
+    "useLegacyCompletionsEndpoint": "false",
+    "X-Tenant-ID": "default_tenant"
+}
+RETRYABLE_ERRORS = (RateLimitError, InternalServerError, APIConnectionError, httpx.TimeoutException, httpx.TransportError)
+
+
+def is_retryable_error(error) -> bool:
+    """
+    Rate limits (429), server errors (5xx), timeouts and connection errors, which another key or a
+    later attempt may not hit. Anything else (bad request, prompt too long, ...) fails on every key.
+    """
+    if isinstance(error, RETRYABLE_ERRORS):
+        return True
+    status_code = getattr(error, "status_code", None)
+    return isinstance(status_code, int) and (status_code == 429 or status_code >= 500)
+
+
+class AIClientRegistry:
+    """
+    Process-wide OpenAI clients keyed on (base_url, api_key, verify, default headers), each with its own
+    keep-alive httpx pool, so callers with different TLS settings or headers never share a client.
+    Clients are created on first use and closed on `close_all` (registered with atexit).
+    """
+    def __init__(self, max_connections: int = AI_POOL_MAX_CONNECTIONS, max_keepalive: int = AI_POOL_MAX_KEEPALIVE,
+                 timeout: float = AI_TIMEOUT, connect_timeout: float = AI_CONNECT_TIMEOUT):
+        self.max_connections = max_connections
+        self.max_keepalive = max_keepalive
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+
+        self.logger = logging.getLogger(__name__)
+
+        self._lock = threading.Lock()
+        self._clients = {}  # (base_url, api_key, verify, headers) -> openai.OpenAI
+        self._http_clients = {}  # (base_url, api_key, verify, headers) -> httpx.Client
+        self._created = 0
+
+    def get(self, base_url: str, api_key: str, default_headers: dict = None, verify: bool = True):
+        key = (base_url, api_key, bool(verify), tuple(sorted((default_headers or {}).items())))
+        with self._lock:
+            client = self._clients.get(key)
+            if client is not None:
+                return client
+
+            http_client = httpx.Client(
+                verify=verify,
+                limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_keepalive),
+                timeout=httpx.Timeout(self.timeout, connect=self.connect_timeout),
+            )
+            client = openai.OpenAI(
+                api_key=api_key,
+                base_url=base_url,
+                default_headers=default_headers,
+                http_client=http_client,
+            )
+            self._clients[key] = client
+            self._http_clients[key] = http_client
+            self._created += 1
+
+        self.logger.info(f"AI client created for {base_url}")
+        return client
+
+    def close_all(self):
+        with self._lock:
+            http_clients = list(self._http_clients.values())
+            self._clients.clear()
+            self._http_clients.clear()
+
+        for http_client in http_clients:
+            try:
+                http_client.close()
+            except Exception as e:
+                self.logger.error(f"Failed to close AI http client: {e}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "clients": len(self._clients),
+                "created": self._created,
+                "max_connections": self.max_connections,
+                "timeout": self.timeout,
+            }
+
+
+ai_clients = AIClientRegistry()
+atexit.register(ai_clients.close_all)
+
+
+class KeyState:
+    """
+    Health of one API key as seen by this process.
+    """
+    __slots__ = ("in_flight", "requests", "failures", "consecutive_failures", "budget_exceeded",
+                 "latency_ewma", "open_until", "last_error")
+
+    def __init__(self):
+        self.in_flight = 0
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.budget_exceeded = 0
+        self.latency_ewma = 0.0
+        self.open_until = 0.0
+        self.last_error = ""
+
+
+class KeyScheduler:
+    """
+    Spread requests over API keys and skip unhealthy ones.
+
+    Healthy keys are ordered least-loaded first (in-flight requests), ties rotate round-robin.
+    A key's circuit opens for `cooldown` seconds after `failure_threshold` consecutive failures,
+    and for `budget_cooldown` seconds right away on "budget has been exceeded" or an auth error.
+    After the cooldown the key is tried again, one more failure re-opens it.
+    Only retryable errors (see `is_retryable_error`) count as failures of the key.
+    """
+    def __init__(self, failure_threshold: int = AI_KEY_FAILURE_THRESHOLD, cooldown: float = AI_KEY_COOLDOWN,
+                 budget_cooldown: float = AI_KEY_BUDGET_COOLDOWN):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.budget_cooldown = budget_cooldown
+
+        self.logger = logging.getLogger(__name__)
+
+        self._lock = threading.Lock()
+        self._states = {}  # api key -> KeyState
+        self._rr = 0
+
+    def _state(self, key) -> KeyState:
+        state = self._states.get(key)
+        if state is None:
+            state = self._states[key] = KeyState()
+        return state
+
+    def candidates(self, keys, include_open: bool = False) -> list:
+        """
+        Keys in the order they should be tried. Keys with an open circuit are left out,
+        or put last (soonest to recover first) with `include_open`.
+        """
+        keys = list(keys)
+        if not keys:
+            return []
+
+        now = time.time()
+        with self._lock:
+            shift = self._rr % len(keys)
+            self._rr += 1
+            rotated = keys[shift:] + keys[:shift]
+            healthy = [k for k in rotated if self._state(k).open_until <= now]
+            healthy.sort(key=lambda k: self._states[k].in_flight)
+            if not include_open:
+                return healthy
+            opened = sorted((k for k in rotated if k not in healthy), key=lambda k: self._states[k].open_until)
+
+        return healthy + opened
+
+    def begin(self, key) -> float:
+        with self._lock:
+            state = self._state(key)
+            state.in_flight += 1
+            state.requests += 1
+        return time.monotonic()
+
+    def success(self, key, started: float):
+        latency = time.monotonic() - started
+        with self._lock:
+            state = self._state(key)
+            state.in_flight -= 1
+            state.consecutive_failures = 0
+            state.open_until = 0.0
+            state.latency_ewma = latency if not state.latency_ewma else 0.8 * state.latency_ewma + 0.2 * latency
+
+    def cancel(self, key):
+        """
+        The request was abandoned by the caller, neither a success nor a failure of the key.
+        """
+        with self._lock:
+            self._state(key).in_flight -= 1
+
+    def failure(self, key, started: float, error) -> bool:
+        """
+        Record a failed request. Return False when the error is not the key's fault,
+        the caller should then raise it instead of trying another key.
+        """
+        message = str(error)
+        budget = "budget has been exceeded" in message.lower() or isinstance(error, AuthenticationError)
+        with self._lock:
+            state = self._state(key)
+            state.in_flight -= 1
+            if not budget and not is_retryable_error(error):
+                state.last_error = message[:200]
+                return False
+            state.failures += 1
+            state.consecutive_failures += 1
+            state.last_error = message[:200]
+            if budget:
+                state.budget_exceeded += 1
+                state.open_until = time.time() + self.budget_cooldown
+            elif state.consecutive_failures >= self.failure_threshold:
+                state.open_until = time.time() + self.cooldown
+            opened = state.open_until > time.time()
+
+        if opened:
+            self.logger.warning(f"Circuit open for API key ...{key[-4:]}: {message[:200]}")
+        return True
+
+    def stats(self) -> dict:
+        now = time.time()
+        with self._lock:
+            return {
+                f"...{key[-4:]}": {
+                    "state": "open" if state.open_until > now else "closed",
+                    "open_for": round(max(0.0, state.open_until - now), 1),
+                    "in_flight": state.in_flight,
+                    "requests": state.requests,
+                    "failures": state.failures,
+                    "budget_exceeded": state.budget_exceeded,
+                    "error_rate": round(state.failures / state.requests, 3) if state.requests else 0.0,
+                    "latency_ewma": round(state.latency_ewma, 3),
+                    "last_error": state.last_error,
+                }
+                for key, state in self._states.items()
+            }
+
+
+vio_keys = KeyScheduler()
+
+
+class HedgePolicy:
+    """
+    When to hedge a VIO request with the local model, and how hedging turned out.
+    The delay is the p95 of recent successful VIO latencies (at least `min_delay`),
+    `initial_delay` is used until `min_samples` latencies are known.
+    """
+    def __init__(self, initial_delay: float = AI_HEDGE_DELAY, min_delay: float = AI_HEDGE_MIN_DELAY,
+                 window: int = 200, min_samples: int = 20):
+        self.initial_delay = initial_delay
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=window)
+        self._requests = 0
+        self._hedged = 0
+        self._winners = {"vio": 0, "local": 0, "none": 0}
+
+    def record_latency(self, latency: float):
+        with self._lock:
+            self._latencies.append(latency)
+
+    def delay(self) -> float:
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return self.initial_delay
+            latencies = sorted(self._latencies)
+        return max(self.min_delay, latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))])
+
+    def record(self, hedged: bool, winner: str):
+        with self._lock:
+            self._requests += 1
+            self._hedged += int(hedged)
+            self._winners[winner] += 1
+
+    def stats(self) -> dict:
+        delay = self.delay()
+        with self._lock:
+            return {
+                "enabled": AI_HEDGE,
+                "delay": round(delay, 3),
+                "requests": self._requests,
+                "hedged": self._hedged,
+                "hedge_rate": round(self._hedged / self._requests, 3) if self._requests else 0.0,
+                "winners": dict(self._winners),
+            }
+
+
+ai_hedge = HedgePolicy()
+
+
+class AdmissionTimeout(TimeoutError):
+    """
+    A request waited longer than its deadline for an AI endpoint slot.
+    """
+
+
+class EndpointState:
+    """
+    Admission state of one AI base url.
+    """
+    __slots__ = ("in_flight", "key_in_flight", "waiters", "tokens", "last_refill", "admitted", "timed_out", "wait_max")
+
+    def __init__(self, tokens):
+        self.in_flight = 0
+        self.key_in_flight = Counter()
+        self.waiters = {}  # api key -> deque of waiting tickets, in arrival order
+        self.tokens = tokens
+        self.last_refill = time.monotonic()
+        self.admitted = 0
+        self.timed_out = 0
+        self.wait_max = 0.0
+
+    def next_ticket(self, key_limit):
+        """
+        Oldest ticket at the head of a key queue whose key is below `key_limit`, None if there is none.
+        """
+        heads = [queue[0] for key, queue in self.waiters.items() if self.key_in_flight[key] < key_limit]
+        return min(heads) if heads else None
+
+
+class AdmissionController:
+    """
+    Admit AI requests per endpoint: at most `endpoint_limit` in flight per base url and `key_limit`
+    per API key, and a tokens-per-minute bucket on the prompt size.
+    Requests wait in one FIFO queue per key until admitted or `timeout` passes. A free endpoint slot
+    goes to the oldest request whose key is below its limit, so a busy key never blocks the others.
+    """
+    def __init__(self, endpoint_limit: int = AI_ENDPOINT_CONCURRENCY, key_limit: int = AI_KEY_CONCURRENCY,
+                 tokens_per_minute: int = AI_TOKENS_PER_MINUTE, timeout: float = AI_ADMISSION_TIMEOUT):
+        self.endpoint_limit = endpoint_limit
+        self.key_limit = key_limit
+        self.tokens_per_minute = tokens_per_minute
+        self.timeout = timeout
+
+        self.logger = logging.getLogger(__name__)
+
+        self._cond = threading.Condition()
+        self._endpoints = {}  # base url -> EndpointState
+        self._tickets = itertools.count()
+
+    def _state(self, endpoint) -> EndpointState:
+        state = self._endpoints.get(endpoint)
+        if state is None:
+            state = self._endpoints[endpoint] = EndpointState(self.tokens_per_minute)
+        return state
+
+    def _refill(self, state, now):
+        state.tokens = min(self.tokens_per_minute, state.tokens + (now - state.last_refill) * self.tokens_per_minute / 60)
+        state.last_refill = now
+
+    def acquire(self, endpoint: str, key: str, tokens: int = 0, timeout: float = None):
+        """
+        Block until the request is admitted. Raise AdmissionTimeout after `timeout` seconds.
+        """
+        tokens = min(tokens, self.tokens_per_minute)  # a prompt larger than the bucket still gets through alone
+        timeout = self.timeout if timeout is None else timeout
+        start = time.monotonic()
+
+        with self._cond:
+            ticket = next(self._tickets)
+            state = self._state(endpoint)
+            queue = state.waiters.setdefault(key, deque())
+            queue.append(ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(state, now)
+                    wait_for = start + timeout - now
+                    if state.in_flight < self.endpoint_limit and state.next_ticket(self.key_limit) == ticket:
+                        if state.tokens >= tokens:
+                            break
+                        # only the token bucket blocks: sleep until enough tokens are refilled
+                        wait_for = min(wait_for, (tokens - state.tokens) * 60 / self.tokens_per_minute)
+                    if start + timeout - now <= 0:
+                        state.timed_out += 1
+                        raise AdmissionTimeout(f"AI request to {endpoint} was not admitted within {timeout}s")
+                    self._cond.wait(max(wait_for, 0.01))
+
+                queue.popleft()
+                state.in_flight += 1
+                state.key_in_flight[key] += 1
+                state.tokens -= tokens
+                state.admitted += 1
+                state.wait_max = max(state.wait_max, time.monotonic() - start)
+
+            finally:
+                if ticket in queue:
+                    queue.remove(ticket)
+                if not queue:
+                    state.waiters.pop(key, None)
+                self._cond.notify_all()
+
+    def release(self, endpoint: str, key: str):
+        with self._cond:
+            state = self._state(endpoint)
+            state.in_flight -= 1
+            state.key_in_flight[key] -= 1
+            if state.key_in_flight[key] <= 0:
+                del state.key_in_flight[key]
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, endpoint: str, key: str, tokens: int = 0, timeout: float = None):
+        self.acquire(endpoint, key, tokens, timeout)
+        try:
+            yield
+        finally:
+            self.release(endpoint, key)
+
+    def stats(self) -> dict:
+        with self._cond:
+            now = time.monotonic()
+            result = {}
+            for endpoint, state in self._endpoints.items():
+                self._refill(state, now)
+                result[endpoint] = {
+                    "in_flight": state.in_flight,
+                    "queued": sum(len(queue) for queue in state.waiters.values()),
+                    "tokens_available": int(state.tokens),
+                    "admitted": state.admitted,
+                    "timed_out": state.timed_out,
+                    "wait_max": round(state.wait_max, 3),
+                }
+            return {
+                "endpoint_limit": self.endpoint_limit,
+                "key_limit": self.key_limit,
+                "tokens_per_minute": self.tokens_per_minute,
+                "endpoints": result,
+            }
+
+
+ai_admission = AdmissionController()
+
+
+def estimate_messages_tokens(messages) -> int:
+    return sum(estimate_tokens(m.get("content", "")) for m in messages)
+
+
+def make_usage_record(response, model: str, endpoint: str, api_key: str, latency: float, retries: int = 0,
+                      messages=None, answer: str = "", purpose: str = "") -> dict:
+    """
+    Usage of one AI call. Token counts come from `response.usage`, estimated locally when the endpoint omits them.
+    `cached_tokens` is the part of the prompt served from the provider's prefix cache, 0 when not reported.
+    """
+    usage = getattr(response, "usage", None)
+    prompt_tokens = getattr(usage, "prompt_tokens", None)
+    completion_tokens = getattr(usage, "completion_tokens", None)
+    cached_tokens = getattr(getattr(usage, "prompt_tokens_details", None), "cached_tokens", None) or 0
+    estimated = prompt_tokens is None or completion_tokens is None
+    if prompt_tokens is None:
+        prompt_tokens = estimate_messages_tokens(messages or [])
+    if completion_tokens is None:
+        completion_tokens = estimate_tokens(answer or "")
+    return {
+        "purpose": purpose,
+        "model": model,
+        "endpoint": endpoint,
+        "key": f"...{(api_key or '')[-4:]}",
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "cached_tokens": cached_tokens,
+        "latency": round(latency, 3),
+        "retries": retries,
+        "estimated": estimated,
+        "created_at": round(time.time(), 3),
+    }
+
+
+_hedge_executor = ThreadPoolExecutor(max_workers=AI_HEDGE_WORKERS, thread_name_prefix="ai-hedge")
+
 
 class AIPrReview:
     def __init__(
@@ -24,6 +501,7 @@ class AIPrReview:
 
         self.logger = logging.getLogger(__name__)
         self.messages = []
+        self.usage = []  # make_usage_record() of every successful call
 
         # Add system prompt if provided
         if system_prompt:
@@ -33,18 +511,19 @@ class AIPrReview:
         """
         Call local model via ...
         """
-        client = openai.OpenAI(
-                api_key=self.local_ai_api_key,
-                base_url=self.local_ai_base_url, 
-            )
-        
         try:
-            response = client.chat.completions.create(
-                model=self.local_ai_model_name,  # Local AI model name
-                messages=self.messages
-            )
+            client = ai_clients.get(self.local_ai_base_url, self.local_ai_api_key)
+
+            with ai_admission.slot(self.local_ai_base_url, self.local_ai_api_key, estimate_messages_tokens(self.messages)):
+                start = time.monotonic()
+                response = client.chat.completions.create(
+                    model=self.local_ai_model_name,  # Local AI model name
+                    messages=self.messages
+                )
             
             answer = response.choices[0].message.content
+            self.usage.append(make_usage_record(response, self.local_ai_model_name, "local", self.local_ai_api_key,
+                                                time.monotonic() - start, messages=self.messages, answer=answer))
 
             return answer
 
@@ -64,41 +543,97 @@ class AIPrReview:
         Call VIO via OpenAI API
         """
 
-        for api_key in self.vio_api_key:
-            client = openai.OpenAI(
-                api_key=api_key,
-                base_url=self.vio_base_url,  
-                default_headers={
-                    "useLegacyCompletionsEndpoint": "false",
-                    "X-Tenant-ID": "default_tenant"
-                }
-            )
+        prompt_tokens = estimate_messages_tokens(self.messages)
+        for retries, api_key in enumerate(vio_keys.candidates(self.vio_api_key)):
+            try:
+                ai_admission.acquire(self.vio_base_url, api_key, prompt_tokens)
+            except AdmissionTimeout as e:
+                self.logger.error(f"VIO API not admitted: {e}")
+                return None
 
+            started = vio_keys.begin(api_key)
             try:
+                client = ai_clients.get(self.vio_base_url, api_key, default_headers=VIO_DEFAULT_HEADERS)
+
                 response = client.chat.completions.create(
                     model=self.vio_model_name,  # VIO model name
                     messages=self.messages
                 )
                 
                 answer = response.choices[0].message.content
+                vio_keys.success(api_key, started)
+                self.usage.append(make_usage_record(response, self.vio_model_name, "vio", api_key, time.monotonic() - started,
+                                                    retries=retries, messages=self.messages, answer=answer))
 
                 return answer
 
             except AuthenticationError as e:
-                self.logger.error(f"VIO API AuthenticationError with API key {api_key}: {e}", exc_info=True)  
+                vio_keys.failure(api_key, started, e)
+                self.logger.error(f"VIO API AuthenticationError with API key ...{api_key[-4:]}: {e}", exc_info=True)  
 
             except InternalServerError as e:
-                self.logger.error(f"VIO API InternalServerError with API key {api_key}: {e}", exc_info=True)
+                vio_keys.failure(api_key, started, e)
+                self.logger.error(f"VIO API InternalServerError with API key ...{api_key[-4:]}: {e}", exc_info=True)
             
             except Exception as e:
-                self.logger.error(f"VIO API error with API key {api_key}: {e}", exc_info=True)
+                if not vio_keys.failure(api_key, started, e):
+                    self.logger.error(f"VIO API request rejected, not retried with other keys: {e}", exc_info=True)
+                    return None
+                self.logger.error(f"VIO API error with API key ...{api_key[-4:]}: {e}", exc_info=True)
+
+            finally:
+                ai_admission.release(self.vio_base_url, api_key)
 
         return None
 
+    def _call_vio_model_timed(self):
+        start = time.monotonic()
+        answer = self._call_vio_model()
+        if answer is not None:
+            ai_hedge.record_latency(time.monotonic() - start)
+        return answer
+
+    def _chat_hedged(self):
+        """
+        Start VIO, and if it has not answered within the hedge delay, send the same request to the local model.
+        The first valid answer wins. The other request cannot be interrupted, its result is discarded.
+        """
+        pending = {_hedge_executor.submit(self._call_vio_model_timed): "vio"}
+        local_started = False
+        hedged = False
+        timeout = ai_hedge.delay()
+
+        while pending:
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                source = pending.pop(future)
+                answer = future.result()
+                if answer:
+                    for other in pending:
+                        other.cancel()
+                    ai_hedge.record(hedged, source)
+                    if hedged:
+                        self.logger.info(f"Hedged AI request won by {source}")
+                    return answer
+
+            if not local_started:
+                # VIO 超过对冲延迟仍未返回（hedge），或已失败（普通降级）
+                hedged = bool(pending)
+                self.logger.info("VIO response is slow, hedge with local model." if hedged else "Get VIO response failed, switch to local model.")
+                pending[_hedge_executor.submit(self._call_local_model)] = "local"
+                local_started = True
+            timeout = None
+
+        ai_hedge.record(hedged, "none")
+        return None
+
     def chat(self, question):
         # Add user question
         self.messages.append({"role": "user", "content": question})
 
+        if AI_HEDGE and self.local_ai_base_url:
+            return self._chat_hedged()
+
         # Try VIO first
         result = self._call_vio_model()
         
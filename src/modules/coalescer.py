@@ -0,0 +1,140 @@
+import logging
+import threading
+from datetime import datetime
+
+from configs.config import COALESCE_QUIET_PERIOD
+
+
+class ReviewSuperseded(Exception):
+    """
+    Raised inside a review when a newer head has been pushed to the same PR.
+    """
+
+
+class PRCoalescer:
+    """
+    Debounce bursts of `synchronize` events per PR.
+
+    Every pull_request event records the newest head sha of its PR, ordered by `pull_request.updated_at`
+    so a late delivery of an older push cannot move it back. `synchronize` events are held for a quiet
+    period and only the newest one per PR is dispatched. Running reviews call `is_superseded` to abort
+    once their head is no longer current. Closed PRs are forgotten.
+    """
+    def __init__(self, quiet_period: float = COALESCE_QUIET_PERIOD):
+        self.quiet_period = quiet_period
+        self.dispatch = None  # callable(request) -> bool, set by the webhook
+
+        self.logger = logging.getLogger(__name__)
+
+        self._lock = threading.Lock()
+        self._pending = {}  # key -> threading.Timer
+        self._latest_heads = {}  # key -> (updated_at timestamp, newest head sha)
+        self._coalesced = 0
+        self._superseded = 0
+        self._stale = 0
+
+    @staticmethod
+    def get_key(payload: dict):
+        repository = payload.get("repository", {})
+        full_name = repository.get("full_name") or f"{repository.get('owner', {}).get('login', '')}/{repository.get('name', '')}"
+        number = payload.get("pull_request", {}).get("number", 0)
+        if not number or full_name == "/":
+            return None
+        return full_name, number
+
+    @staticmethod
+    def get_updated_at(payload: dict) -> float:
+        """
+        `pull_request.updated_at` as a timestamp, 0 when missing.
+        """
+        updated_at = payload.get("pull_request", {}).get("updated_at") or ""
+        try:
+            return datetime.fromisoformat(updated_at.replace("Z", "+00:00")).timestamp()
+        except ValueError:
+            return 0.0
+
+    def submit(self, event, request) -> bool:
+        """
+        Route one webhook event. Non-PR events and `opened` go straight to dispatch,
+        `synchronize` events wait for the quiet period.
+        """
+        payload = request.json
+        key = self.get_key(payload) if event == "pull_request" else None
+        head_sha = payload.get("pull_request", {}).get("head", {}).get("sha", "")
+
+        if key is None or not head_sha:
+            return self.dispatch(request)
+
+        action = payload.get("action")
+        updated_at = self.get_updated_at(payload)
+
+        with self._lock:
+            stale = False
+            if action == "closed":
+                self._latest_heads.pop(key, None)
+                timer = self._pending.pop(key, None)
+                if timer is not None:
+                    timer.cancel()
+            else:
+                latest = self._latest_heads.get(key)
+                stale = latest is not None and 0 < updated_at < latest[0] and latest[1] != head_sha
+                if stale:
+                    self._stale += 1
+                else:
+                    self._latest_heads[key] = (updated_at, head_sha)
+
+            debounce = action == "synchronize" and self.quiet_period > 0
+
+        if stale and action == "synchronize":
+            self.logger.info(f"Drop out-of-order synchronize event for {key[0]}#{key[1]}, head {head_sha} is older than {latest[1]}")
+            return True
+
+        if not debounce:
+            return self.dispatch(request)
+
+        with self._lock:
+            timer = self._pending.pop(key, None)
+            if timer is not None:
+                timer.cancel()
+                self._coalesced += 1
+                self.logger.info(f"Coalesced synchronize event for {key[0]}#{key[1]}, newest head {head_sha}")
+
+            timer = threading.Timer(self.quiet_period, self._fire, args=(key, request))
+            timer.daemon = True
+            self._pending[key] = timer
+            timer.start()
+
+        return True
+
+    def _fire(self, key, request):
+        with self._lock:
+            self._pending.pop(key, None)
+
+        if not self.dispatch(request):
+            self.logger.error(f"Failed to dispatch coalesced event for {key[0]}#{key[1]}")
+
+    def is_superseded(self, key, head_sha) -> bool:
+        if key is None or not head_sha:
+            return False
+
+        with self._lock:
+            latest = self._latest_heads.get(key)
+            superseded = latest is not None and latest[1] != head_sha
+            if superseded:
+                self._superseded += 1
+
+        return superseded
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "quiet_period": self.quiet_period,
+                "pending": len(self._pending),
+                "tracked_prs": len(self._latest_heads),
+                "coalesced": self._coalesced,
+                "superseded": self._superseded,
+                "stale": self._stale,
+            }
+
+
+pr_coalescer = PRCoalescer()
@@ -0,0 +1,110 @@
+import os
+import time
+import sqlite3
+import logging
+import threading
+
+from configs.config import DEDUP_DB_PATH, DEDUP_TTL
+
+
+class DeliveryStore:
+    """
+    Idempotency store keyed on the `X-GitHub-Delivery` header, backed by a local SQLite file.
+    A delivery id seen within `ttl` seconds is reported as duplicate.
+    """
+    def __init__(self, db_path: str = DEDUP_DB_PATH, ttl: int = DEDUP_TTL, purge_interval: int = 300):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.purge_interval = purge_interval
+
+        self.logger = logging.getLogger(__name__)
+
+        self._lock = threading.Lock()
+        self._conn = None
+        self._last_purge = 0.0
+        self._accepted = 0
+        self._duplicates = 0
+
+    def _connect(self):
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS deliveries ("
+            "delivery_id TEXT PRIMARY KEY, "
+            "event TEXT, "
+            "received_at REAL NOT NULL)"
+        )
+
+    def _purge(self, now):
+        self._conn.execute("DELETE FROM deliveries WHERE received_at < ?", (now - self.ttl,))
+        self._last_purge = now
+
+    def is_duplicate(self, delivery_id: str, event: str = "") -> bool:
+        """
+        Record the delivery and return True if it was already recorded within the TTL.
+        Storage errors never block an event, they are logged and the event is processed.
+        """
+        if not delivery_id:
+            return False
+
+        now = time.time()
+
+        with self._lock:
+            try:
+                if self._conn is None:
+                    self._connect()
+
+                if now - self._last_purge > self.purge_interval:
+                    self._purge(now)
+
+                cur = self._conn.execute(
+                    "INSERT OR IGNORE INTO deliveries (delivery_id, event, received_at) VALUES (?, ?, ?)",
+                    (delivery_id, event, now)
+                )
+                duplicate = cur.rowcount == 0
+
+            except sqlite3.Error as e:
+                self.logger.error(f"Delivery store error for {delivery_id}: {e}", exc_info=True)
+                return False
+
+            if duplicate:
+                self._duplicates += 1
+            else:
+                self._accepted += 1
+
+        return duplicate
+
+    def forget(self, delivery_id: str):
+        """
+        Remove a recorded delivery, e.g. when it was rejected and GitHub will redeliver it.
+        """
+        if not delivery_id:
+            return
+
+        with self._lock:
+            try:
+                if self._conn is None:
+                    self._connect()
+                cur = self._conn.execute("DELETE FROM deliveries WHERE delivery_id = ?", (delivery_id,))
+                if cur.rowcount:
+                    self._accepted -= 1
+            except sqlite3.Error as e:
+                self.logger.error(f"Delivery store error for {delivery_id}: {e}", exc_info=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "ttl": self.ttl,
+                "accepted": self._accepted,
+                "duplicates": self._duplicates,
+            }
+
+    def close(self):
+        with self._lock:
+            if self._conn:
+                self._conn.close()
+                self._conn = None
+
+
+delivery_store = DeliveryStore()
@@ -0,0 +1,252 @@
+import hashlib
+
+
+class DiffHunk:
+    """
+    One `@@` hunk, stored as offsets into the shared diff text.
+    """
+    __slots__ = ("start", "end", "additions", "deletions")
+
+    def __init__(self, start):
+        self.start = start
+        self.end = start
+        self.additions = 0
+        self.deletions = 0
+
+
+class DiffFile:
+    """
+    One `diff --git` section, stored as offsets into the shared diff text.
+    `header_end` is where the first hunk starts (None for binary/rename-only sections).
+    """
+    __slots__ = ("diff", "start", "end", "header_end", "path", "old_path", "status", "additions", "deletions", "hunks")
+
+    def __init__(self, diff, start, path, old_path):
+        self.diff = diff
+        self.start = start
+        self.end = start
+        self.header_end = None
+        self.path = path
+        self.old_path = old_path
+        self.status = "modified"
+        self.additions = 0
+        self.deletions = 0
+        self.hunks = []
+
+    def __len__(self):
+        return self.end - self.start
+
+    @property
+    def text(self):
+        return self.diff.text[self.start:self.end]
+
+    def segments(self, max_chars=None):
+        """
+        Yield (start, end) offsets of this file, cut at hunk boundaries when `max_chars` is given.
+        """
+        if max_chars is None or len(self) <= max_chars:
+            yield self.start, self.end
+            return
+
+        header_end = self.header_end if self.header_end is not None else self.end
+        if header_end - self.start > max_chars:
+            return
+
+        yield self.start, header_end
+        budget = max_chars - (header_end - self.start)
+        for hunk in self.hunks:
+            size = hunk.end - hunk.start
+            if size > budget:
+                return
+            yield hunk.start, hunk.end
+            budget -= size
+
+
+class PRDiff:
+    """
+    Parsed unified git diff. The text is kept once, files and hunks only hold offsets into it,
+    so filtering, truncation, prompt assembly and history writing do not re-split or copy it.
+    """
+    __slots__ = ("text", "files")
+
+    def __init__(self, text: str):
+        self.text = text or ""
+        self.files = []
+        self._parse()
+
+    def __len__(self):
+        return len(self.text)
+
+    def _header_value(self, pos, end, prefix):
+        return self.text[pos + len(prefix):end].rstrip("\r\n")
+
+    def _parse(self):
+        text = self.text
+        size = len(text)
+        current = None
+        hunk = None
+        pos = 0
+
+        while pos < size:
+            nl = text.find("\n", pos)
+            end = size if nl == -1 else nl + 1
+
+            if text.startswith("diff --git ", pos, end):
+                if current is not None:
+                    current.end = pos
+                    if hunk is not None:
+                        hunk.end = pos
+                old_path, _, new_path = self._header_value(pos, end, "diff --git ").partition(" b/")
+                current = DiffFile(self, pos, new_path, old_path[2:] if old_path.startswith("a/") else old_path)
+                self.files.append(current)
+                hunk = None
+
+            elif current is None:
+                pass
+
+            elif text.startswith("@@", pos, end):
+                if hunk is not None:
+                    hunk.end = pos
+                else:
+                    current.header_end = pos
+                hunk = DiffHunk(pos)
+                current.hunks.append(hunk)
+
+            elif hunk is not None:
+                if text.startswith("+", pos, end):
+                    hunk.additions += 1
+                    current.additions += 1
+                elif text.startswith("-", pos, end):
+                    hunk.deletions += 1
+                    current.deletions += 1
+
+            elif text.startswith("new file mode", pos, end):
+                current.status = "added"
+            elif text.startswith("deleted file mode", pos, end):
+                current.status = "removed"
+            elif text.startswith("rename from ", pos, end):
+                current.old_path = self._header_value(pos, end, "rename from ")
+                current.status = "renamed"
+            elif text.startswith("rename to ", pos, end):
+                current.path = self._header_value(pos, end, "rename to ")
+                current.status = "renamed"
+            elif text.startswith("--- a/", pos, end):
+                current.old_path = self._header_value(pos, end, "--- a/")
+            elif text.startswith("+++ b/", pos, end):
+                current.path = self._header_value(pos, end, "+++ b/")
+
+            pos = end
+
+        if current is not None:
+            current.end = size
+            if hunk is not None:
+                hunk.end = size
+
+    def filter(self, exclude_exts=()) -> list:
+        """
+        Return the files whose path does not end with any of `exclude_exts`.
+        """
+        exclude_exts = tuple(exclude_exts)
+        if not exclude_exts:
+            return list(self.files)
+        return [f for f in self.files if not f.path.endswith(exclude_exts)]
+
+    def group_files(self, max_chars: int, files=None) -> list:
+        """
+        Split `files` (all files by default) into ordered groups of at most `max_chars` diff text.
+        A file larger than `max_chars` gets a group of its own and is cut at hunk boundaries when rendered.
+        """
+        files = self.files if files is None else files
+        groups = []
+        current = []
+        size = 0
+
+        for f in files:
+            if current and size + len(f) > max_chars:
+                groups.append(current)
+                current = []
+                size = 0
+            current.append(f)
+            size += len(f)
+
+        if current:
+            groups.append(current)
+
+        return groups
+
+    def changed_files(self) -> list:
+        """
+        Changed-file records in the shape of the GitHub `/pulls/{n}/files` API.
+        """
+        return [
+            {
+                "filename": f.path,
+                "previous_filename": f.old_path if f.status == "renamed" else "",
+                "status": f.status,
+                "additions": f.additions,
+                "deletions": f.deletions,
+            }
+            for f in self.files
+        ]
+
+    def segments(self, files=None, max_chars=None):
+        """
+        Yield (start, end) offsets of `files` (all files by default) in order. With `max_chars`,
+        stop at the first file that does not fit completely, after its fitting hunks.
+        """
+        files = self.files if files is None else files
+        budget = max_chars
+
+        for f in files:
+            if budget is None:
+                yield f.start, f.end
+                continue
+
+            used = 0
+            for start, end in f.segments(budget):
+                yield start, end
+                used += end - start
+
+            budget -= used
+            if used < len(f) or budget <= 0:
+                return
+
+    def is_truncated(self, files=None, max_chars=None) -> bool:
+        files = self.files if files is None else files
+        return max_chars is not None and sum(len(f) for f in files) > max_chars
+
+    def render(self, files=None, max_chars=None, truncation_note="") -> str:
+        """
+        Return the diff text of `files`. Without filtering or truncation this is the original string, no copy.
+        """
+        if files is None and (max_chars is None or len(self.text) <= max_chars):
+            return self.text
+
+        text = "".join(self.text[start:end] for start, end in self.segments(files, max_chars))
+        if self.is_truncated(files, max_chars):
+            text += truncation_note
+        return text
+
+    def patch_id(self) -> str:
+        """
+        Stable fingerprint of the change, like `git patch-id --stable`: only the paths and the
+        added/removed lines with whitespace removed are hashed, so line numbers, context,
+        index shas and file order do not matter. Empty when the text has no file diff
+        (e.g. a placeholder for a too large PR), such a change has no identity to compare.
+        """
+        if not self.files:
+            return ""
+        text = self.text
+        h = hashlib.sha1()
+        for f in sorted(self.files, key=lambda f: f.path):
+            h.update(f"{f.old_path}\0{f.path}\0{f.status}\n".encode("utf-8", errors="replace"))
+            for hunk in f.hunks:
+                pos = text.find("\n", hunk.start, hunk.end) + 1  # skip the @@ line
+                while 0 < pos < hunk.end:
+                    nl = text.find("\n", pos, hunk.end)
+                    end = hunk.end if nl == -1 else nl + 1
+                    if text.startswith(("+", "-"), pos, end):
+                        h.update("".join(text[pos:end].split()).encode("utf-8", errors="replace"))
+                        h.update(b"\n")
+                    pos = end
+        return h.hexdigest()
@@ -1,8 +1,74 @@
 import requests
+from requests.adapters import HTTPAdapter
 import re
 import logging
+import threading
+from collections import Counter
+from urllib.parse import urlsplit
+
+from configs.config import GITHUB_URL, GITHUB_POOL_SIZE, GITHUB_POOL_HOSTS
+from .diff import PRDiff
+
+class GithubSessionPool:
+    """
+    Process-wide keep-alive connection pool shared by every GitHub call.
+    Credentials are passed per request, so one session serves all orchestrators.
+    """
+    def __init__(self, pool_size: int = GITHUB_POOL_SIZE, pool_hosts: int = GITHUB_POOL_HOSTS):
+        self.pool_size = pool_size
+        self.adapter = HTTPAdapter(pool_connections=pool_hosts, pool_maxsize=pool_size)
+        self.session = requests.Session()
+        self.session.mount("https://", self.adapter)
+        self.session.mount("http://", self.adapter)
+
+        self._lock = threading.Lock()
+        self._requests = Counter()
+        self._errors = Counter()
+
+    def request(self, method: str, url: str, **kwargs):
+        host = urlsplit(url).netloc
+        with self._lock:
+            self._requests[host] += 1
+
+        try:
+            return self.session.request(method, url, **kwargs)
+        except requests.RequestException:
+            with self._lock:
+                self._errors[host] += 1
+            raise
+
+    def get(self, url: str, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def patch(self, url: str, **kwargs):
+        return self.request("PATCH", url, **kwargs)
+
+    def stats(self) -> dict:
+        """
+        Per-host request counts and connection reuse. `connections` counts TCP+TLS handshakes.
+        """
+        hosts = {}
+        with self._lock:
+            for host, count in self._requests.items():
+                hosts[host] = {"requests": count, "errors": self._errors.get(host, 0), "connections": 0}
+
+        pools = self.adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            host = pool.host if pool.port in (None, 80, 443) else f"{pool.host}:{pool.port}"
+            entry = hosts.setdefault(host, {"requests": 0, "errors": 0, "connections": 0})
+            entry["connections"] += pool.num_connections
+
+        return {"pool_size": self.pool_size, "hosts": hosts}
+
+
+github_pool = GithubSessionPool()
 
-from configs.config import GITHUB_URL
 
 class GithubPROps:
     """
@@ -11,11 +77,10 @@ class GithubPROps:
     def __init__(self, username: str = None, password: str = None):
         self.username = username
         self.password = password
-        self.session = requests.Session()
+        self.session = github_pool
         escaped_url = GITHUB_URL.replace('.', '\\.')
         self.pr_url_pattern = re.compile(rf"{escaped_url}/([^/]+)/([^/]+)/pull/(\d+)")
-        if self.username and self.password:
-            self.session.auth = (self.username, self.password)
+        self.auth = (self.username, self.password) if self.username and self.password else None
         self.logger = logging.getLogger(__name__)
 
     def parse_pr_url(self, pr_url: str):
@@ -35,7 +100,7 @@ class GithubPROps:
     def get_pr_diff(self, pr_url: str) -> str:
         api_url = self._get_api_url(pr_url)
         headers = {"Accept": "application/vnd.github.v3.diff"}
-        resp = self.session.get(api_url, headers=headers, timeout=60)
+        resp = self.session.get(api_url, headers=headers, timeout=60, auth=self.auth)
         resp.raise_for_status()
         return resp.text
 
@@ -43,7 +108,7 @@ class GithubPROps:
         owner, repo, pr_number = self.parse_pr_url(pr_url)
         files_api_url = f"{GITHUB_URL}/api/v3/repos/{owner}/{repo}/pulls/{pr_number}/files"
         headers = {"Accept": "application/vnd.github.v3+json"}
-        resp = self.session.get(files_api_url, headers=headers, timeout=60)
+        resp = self.session.get(files_api_url, headers=headers, timeout=60, auth=self.auth)
         resp.raise_for_status()
         files_data = resp.json()
 
@@ -58,7 +123,7 @@ class GithubPROps:
         comments_url = f"{GITHUB_URL}/api/v3/repos/{owner}/{repo}/issues/{pr_number}/comments"
         headers = {"Accept": "application/vnd.github.v3+json"}
         # 1. Get all comments
-        resp = self.session.get(comments_url, headers=headers, timeout=60)
+        resp = self.session.get(comments_url, headers=headers, timeout=60, auth=self.auth)
         resp.raise_for_status()
         comments = resp.json()
         my_comment = None
@@ -71,18 +136,18 @@ class GithubPROps:
             comment_id = my_comment["id"]
             patch_url = f"{GITHUB_URL}/api/v3/repos/{owner}/{repo}/issues/comments/{comment_id}"
             patch_data = {"body": body}
-            patch_resp = self.session.patch(patch_url, json=patch_data, headers=headers, timeout=10)
+            patch_resp = self.session.patch(patch_url, json=patch_data, headers=headers, timeout=10, auth=self.auth)
             patch_resp.raise_for_status()
         else:
             # 3. Otherwise create new
             data = {"body": body}
-            post_resp = self.session.post(comments_url, json=data, headers=headers, timeout=10)
+            post_resp = self.session.post(comments_url, json=data, headers=headers, timeout=10, auth=self.auth)
             post_resp.raise_for_status()
 
     def get_pr_info(self, pr_url: str):
         api_url = self._get_api_url(pr_url)
         headers = {"Accept": "application/vnd.github.v3+json"}
-        resp = self.session.get(api_url, headers=headers, timeout=60)
+        resp = self.session.get(api_url, headers=headers, timeout=60, auth=self.auth)
         resp.raise_for_status()
         pr_data = resp.json()
         pr_title = pr_data.get("title")
@@ -97,25 +162,5 @@ class GithubPROps:
         return jira_ticket, base_branch, pr_title
 
     def get_pr_filter_diff(self, diff_text, exclude_exts):
-        diff_chunks = re.split(r'(?=^diff --git )', diff_text, flags=re.MULTILINE)
-
-        filtered_chunks = []
-        for chunk in diff_chunks:
-            if not chunk.strip():
-                continue
-
-            first_line = chunk.split('\n', 1)[0]
-            
-            try:
-                file_path_b = first_line.split(' ')[2]
-            except IndexError:
-                filtered_chunks.append(chunk)
-                continue
-            
-            is_excluded = any(file_path_b.endswith(ext) for ext in exclude_exts)
-
-            if not is_excluded:
-                filtered_chunks.append(chunk)
-
-        return "".join(filtered_chunks)
-    
\ No newline at end of file
+        pr_diff = diff_text if isinstance(diff_text, PRDiff) else PRDiff(diff_text)
+        return pr_diff.render(files=pr_diff.filter(exclude_exts))
@@ -0,0 +1,113 @@
+import time
+import queue
+import logging
+import threading
+from collections import deque
+
+
+class ReviewJob:
+    """
+    One webhook event waiting in the review queue.
+    """
+    __slots__ = ("request", "enqueued_at")
+
+    def __init__(self, request):
+        self.request = request
+        self.enqueued_at = time.monotonic()
+
+
+class ReviewJobQueue:
+    """
+    Bounded job queue drained by a fixed pool of worker threads.
+    The webhook only validates and enqueues, workers run the (slow) review handler.
+    """
+    def __init__(self, handler, workers: int = 4, maxsize: int = 500, wait_window: int = 1000):
+        self.handler = handler
+        self.workers = workers
+        self.maxsize = maxsize
+
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.logger = logging.getLogger(__name__)
+
+        self._lock = threading.Lock()
+        self._threads = []
+        self._busy = 0
+        self._enqueued = 0
+        self._processed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._wait_times = deque(maxlen=wait_window)  # seconds spent in queue, most recent jobs
+
+    def start(self):
+        if self._threads:
+            return
+
+        for i in range(self.workers):
+            t = threading.Thread(target=self._worker, name=f"revbot-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+        self.logger.info(f"Review job queue started with {self.workers} workers, max size {self.maxsize}")
+
+    def submit(self, request) -> bool:
+        """
+        Enqueue a request without blocking. Return False when the queue is full.
+        """
+        try:
+            self.queue.put_nowait(ReviewJob(request))
+        except queue.Full:
+            with self._lock:
+                self._rejected += 1
+            self.logger.error(f"Review job queue is full ({self.maxsize}), event rejected")
+            return False
+
+        with self._lock:
+            self._enqueued += 1
+        return True
+
+    def _worker(self):
+        while True:
+            job = self.queue.get()
+            wait_time = time.monotonic() - job.enqueued_at
+
+            with self._lock:
+                self._busy += 1
+                self._wait_times.append(wait_time)
+
+            try:
+                self.handler(job.request)
+                with self._lock:
+                    self._processed += 1
+
+            except Exception as e:
+                self.logger.error(f"Review job failed: {e}", exc_info=True)
+                with self._lock:
+                    self._failed += 1
+
+            finally:
+                with self._lock:
+                    self._busy -= 1
+                self.queue.task_done()
+
+    def stats(self) -> dict:
+        with self._lock:
+            wait_times = sorted(self._wait_times)
+            result = {
+                "depth": self.queue.qsize(),
+                "maxsize": self.maxsize,
+                "workers": self.workers,
+                "busy_workers": self._busy,
+                "enqueued": self._enqueued,
+                "processed": self._processed,
+                "failed": self._failed,
+                "rejected": self._rejected,
+            }
+
+        if wait_times:
+            result["wait_avg"] = round(sum(wait_times) / len(wait_times), 3)
+            result["wait_p95"] = round(wait_times[min(len(wait_times) - 1, int(len(wait_times) * 0.95))], 3)
+            result["wait_max"] = round(wait_times[-1], 3)
+        else:
+            result["wait_avg"] = result["wait_p95"] = result["wait_max"] = 0.0
+
+        return result
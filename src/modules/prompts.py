@@ -0,0 +1,127 @@
+import os
+import re
+import time
+import hashlib
+import logging
+import threading
+
+from configs.config import PROMPT_TEMPLATE_PATH
+
+PLACEHOLDER_PATTERN = re.compile(r"\{\{(\w+)\}\}")
+DEFAULT_GROUP = "default"
+
+
+class PromptTemplate:
+    """
+    One prompt template file, split once into literal text and `{{name}}` placeholders.
+    """
+    __slots__ = ("name", "group", "language", "path", "text", "version", "_parts")
+
+    def __init__(self, name, group, language, path, text):
+        self.name = name
+        self.group = group
+        self.language = language
+        self.path = path
+        self.text = text
+        self.version = hashlib.sha1(text.encode("utf-8")).hexdigest()[:12]
+        self._parts = PLACEHOLDER_PATTERN.split(text)  # even: literal text, odd: placeholder name
+
+    @property
+    def fields(self) -> list:
+        return self._parts[1::2]
+
+    def render(self, **values) -> str:
+        if len(self._parts) == 1:
+            return self.text
+        parts = list(self._parts)
+        for i in range(1, len(parts), 2):
+            parts[i] = str(values[parts[i]])
+        return "".join(parts)
+
+
+class PromptRegistry:
+    """
+    Prompt templates under `root`, loaded once per process: `<group>/<name>.<language>.md`, or
+    `<group>/<name>.md` for language independent templates. A group (project) only holds the
+    templates it overrides, everything else falls back to the `default` group.
+    Files are read as UTF-8 with LF line endings and without the final newline.
+    """
+    def __init__(self, root: str = PROMPT_TEMPLATE_PATH):
+        self.root = root
+
+        self.logger = logging.getLogger(__name__)
+
+        self._lock = threading.Lock()
+        self._templates = None  # (group, name, language) -> PromptTemplate
+        self._loaded_at = None
+
+    def load(self) -> dict:
+        """
+        (Re)load all templates from `root`.
+        """
+        templates = {}
+        for group in sorted(os.listdir(self.root)):
+            group_dir = os.path.join(self.root, group)
+            if not os.path.isdir(group_dir):
+                continue
+
+            for file_name in sorted(os.listdir(group_dir)):
+                if not file_name.endswith(".md"):
+                    continue
+                name, _, language = file_name[:-len(".md")].partition(".")
+                path = os.path.join(group_dir, file_name)
+                with open(path, "r", encoding="utf-8", newline="") as f:
+                    text = f.read().replace("\r\n", "\n")
+                if text.endswith("\n"):
+                    text = text[:-1]
+                templates[(group, name, language)] = PromptTemplate(name, group, language, path, text)
+
+        with self._lock:
+            self._templates = templates
+            self._loaded_at = time.time()
+
+        self.logger.info(f"Loaded {len(templates)} prompt templates from {self.root}")
+        return templates
+
+    def get(self, name: str, group: str = DEFAULT_GROUP, language: str = "zh") -> PromptTemplate:
+        templates = self._templates
+        if templates is None:
+            templates = self.load()
+
+        for key in ((group, name, language), (group, name, ""), (DEFAULT_GROUP, name, language), (DEFAULT_GROUP, name, "")):
+            template = templates.get(key)
+            if template is not None:
+                return template
+
+        raise KeyError(f"Prompt template '{name}' ({language}) not found for '{group}' in {self.root}")
+
+    def render(self, name: str, group: str = DEFAULT_GROUP, language: str = "zh", **values) -> str:
+        return self.get(name, group, language).render(**values)
+
+    def versions(self, names, group: str = DEFAULT_GROUP, language: str = "zh") -> dict:
+        """
+        Template name -> version hash of the templates `group` uses for `names`.
+        """
+        return {name: self.get(name, group, language).version for name in names}
+
+    def version(self, names, group: str = DEFAULT_GROUP, language: str = "zh") -> str:
+        """
+        One version hash over several templates, e.g. all templates that make up the review prompt.
+        """
+        h = hashlib.sha1()
+        for name, version in self.versions(names, group, language).items():
+            h.update(f"{name}:{version}\n".encode("utf-8"))
+        return h.hexdigest()[:12]
+
+    def stats(self) -> dict:
+        with self._lock:
+            templates = self._templates or {}
+            return {
+                "root": self.root,
+                "templates": len(templates),
+                "groups": sorted({group for group, _, _ in templates}),
+                "loaded_at": self._loaded_at,
+            }
+
+
+prompt_registry = PromptRegistry()
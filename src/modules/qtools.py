@@ -0,0 +1,231 @@
+import os
+import re
+import pickle
+import fnmatch
+import logging
+import threading
+from collections import OrderedDict
+
+from configs.config import LIB_PATH, QTOOLS_PROMPT_CACHE_SIZE
+
+ALL_FILES = "*"
+GLOB_CHARS = re.compile(r"[*?\[]")
+
+
+def normalize_path(path: str) -> str:
+    return (path or "").replace("\\", "/")
+
+
+class QtoolsRuleIndex:
+    """
+    Compiled rules of one `lib/<owner>/qtools/<repo>.pkl` (see `QtoolsProcessor._convert_cfg_to_dict`).
+    Rule keys are sorted once into: `*` (every file), plain basenames (hash map), path fragments
+    (substring of the path) and glob patterns (precompiled). `FP.FilePath CONTAINS` rules are always
+    fragments, their `kind` is kept in the pickle. Pickles without `kind` fall back to the key's shape.
+    """
+    def __init__(self, rules: dict, version: str = "", name: str = ""):
+        self.rules = rules
+        self.version = version
+        self.name = name  # <owner>/<repo>
+        self.by_name = {}  # basename -> rule key
+        self.fragments = []  # (normalized path fragment, rule key)
+        self.name_globs = []  # (compiled pattern, rule key), matched against the basename
+        self.path_globs = []  # (compiled pattern, rule key), matched against the end of the path
+        self.all_files = ALL_FILES in rules
+
+        for key in rules:
+            if key == ALL_FILES:
+                continue
+            pattern = normalize_path(key)
+            if rules[key].get('kind') == 'contains':
+                self.fragments.append((pattern, key))
+            elif GLOB_CHARS.search(pattern):
+                # 不含目录的通配符只匹配文件名，含目录的匹配路径结尾
+                if "/" in pattern:
+                    self.path_globs.append((re.compile(fnmatch.translate("*/" + pattern.lstrip("/"))), key))
+                else:
+                    self.name_globs.append((re.compile(fnmatch.translate(pattern)), key))
+            elif "/" in pattern:
+                self.fragments.append((pattern, key))
+            else:
+                self.by_name[pattern] = key
+
+    def __len__(self):
+        return len(self.rules)
+
+    def match_file(self, path: str) -> list:
+        """
+        Rule keys that apply to one changed file, `*` excluded.
+        """
+        path = normalize_path(path)
+        name = path.rsplit("/", 1)[-1]
+        keys = []
+
+        key = self.by_name.get(name)
+        if key is not None:
+            keys.append(key)
+
+        slashed = "/" + path
+        keys.extend(key for fragment, key in self.fragments if fragment in slashed)
+        keys.extend(key for regex, key in self.name_globs if regex.match(name))
+        keys.extend(key for regex, key in self.path_globs if regex.match(slashed))
+
+        return keys
+
+    def match(self, changed_files) -> dict:
+        """
+        Rules of all `changed_files` keyed by rule key, in changed-file order with `*` last.
+        """
+        matched = {}
+        for path in changed_files:
+            for key in self.match_file(path):
+                if key not in matched:
+                    matched[key] = self._rule(key)
+
+        if self.all_files:
+            matched[ALL_FILES] = self._rule(ALL_FILES)
+
+        return matched
+
+    def _rule(self, key):
+        rule = self.rules[key]
+        return {
+            'code_rules': rule['code_rules'],
+            'code_rule_chapters': rule['code_rule_chapters'],
+            'descriptions': rule['descriptions']
+        }
+
+
+class RulePromptCache:
+    """
+    LRU cache of rendered rule prompts, keyed on repo, index version, matched rule keys and language.
+    Pushes to the same PR and PRs touching the same modules render the same rule block.
+    """
+    def __init__(self, max_entries: int = QTOOLS_PROMPT_CACHE_SIZE):
+        self.max_entries = max_entries
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, key, render):
+        """
+        Cached text for `key`, else `render()` and store it.
+        """
+        with self._lock:
+            text = self._entries.get(key)
+            if text is not None:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return text
+            self._misses += 1
+
+        text = render()
+
+        with self._lock:
+            self._entries[key] = text
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+        return text
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "chars": sum(len(text) for text in self._entries.values()),
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 3) if lookups else 0.0,
+            }
+
+
+class QtoolsRuleStore:
+    """
+    Process-wide QtoolsRuleIndex per repo. A pickle is loaded once and reloaded only when
+    its mtime or size changes, so a PR costs one `os.stat` instead of a full unpickle.
+    """
+    def __init__(self, lib_path: str = LIB_PATH):
+        self.lib_path = lib_path
+
+        self.logger = logging.getLogger(__name__)
+
+        self._lock = threading.Lock()
+        self._indexes = {}  # pickle path -> QtoolsRuleIndex
+        self._loads = 0
+        self._lookups = 0
+        self.prompts = RulePromptCache()
+
+    def get_path(self, owner: str, repo: str) -> str:
+        return os.path.join(self.lib_path, owner, 'qtools', repo) + '.pkl'
+
+    def get(self, owner: str, repo: str):
+        """
+        Current QtoolsRuleIndex of the repo, None when it has no qtools rules.
+        """
+        path = self.get_path(owner, repo)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        version = f"{st.st_mtime_ns:x}-{st.st_size:x}"
+
+        with self._lock:
+            self._lookups += 1
+            index = self._indexes.get(path)
+            if index is not None and index.version == version:
+                return index
+
+            try:
+                with open(path, 'rb') as f:
+                    rules = pickle.load(f)
+            except Exception as e:
+                self.logger.error(f"Load qtools rules {path} failed: {e}", exc_info=True)
+                return index  # 保留旧索引，文件写入完成后再重新加载
+
+            index = QtoolsRuleIndex(rules, version, name=f"{owner}/{repo}")
+            self._indexes[path] = index
+            self._loads += 1
+
+        self.logger.info(f"Loaded {len(index)} qtools rules from {path} "
+                         f"({len(index.by_name)} files, {len(index.fragments)} paths, {len(index.name_globs) + len(index.path_globs)} globs)")
+        return index
+
+    def match(self, owner: str, repo: str, changed_files) -> dict:
+        index = self.get(owner, repo)
+        if index is None:
+            return {}
+        return index.match(changed_files)
+
+    def render_prompt(self, index, rules: dict, language: str, render) -> str:
+        """
+        Rule prompt text of `rules` (matched with `index`), rendered by `render(rules, language)`.
+        Rules are passed in a canonical order (`*` last) so the same matched set always gives the same text.
+        """
+        if not rules:
+            return ""
+
+        keys = tuple(sorted(rules, key=lambda key: (key == ALL_FILES, key)))
+        ordered = {key: rules[key] for key in keys}
+        if index is None:
+            return render(ordered, language)
+
+        return self.prompts.get((index.name, index.version, keys, language), lambda: render(ordered, language))
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = {
+                "repos": len(self._indexes),
+                "rules": sum(len(index) for index in self._indexes.values()),
+                "loads": self._loads,
+                "lookups": self._lookups,
+            }
+        stats["prompts"] = self.prompts.stats()
+        return stats
+
+
+qtools_rules = QtoolsRuleStore()
@@ -0,0 +1,154 @@
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+
+from configs.config import REVIEW_CACHE_DB_PATH, REVIEW_CACHE_MAX_ENTRIES, REVIEW_CACHE_MAX_AGE
+
+
+def normalize_diff(diff_text: str) -> str:
+    """
+    Drop the parts of a diff that change without changing the code: `index` blob lines,
+    CRLF line endings and trailing whitespace.
+    """
+    lines = []
+    for line in (diff_text or "").split("\n"):
+        if line.startswith("index "):
+            continue
+        lines.append(line.rstrip())
+    return "\n".join(lines).strip()
+
+
+class ReviewCache:
+    """
+    Content-addressed cache of AI review results, backed by a local SQLite file.
+    Entries older than `max_age` seconds are dropped, beyond `max_entries` the least recently used go first.
+    """
+    def __init__(self, db_path: str = REVIEW_CACHE_DB_PATH, max_entries: int = REVIEW_CACHE_MAX_ENTRIES,
+                 max_age: int = REVIEW_CACHE_MAX_AGE, purge_interval: int = 300):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.purge_interval = purge_interval
+
+        self.logger = logging.getLogger(__name__)
+
+        self._lock = threading.Lock()
+        self._conn = None
+        self._last_purge = 0.0
+        self._hits = 0
+        self._misses = 0
+        self._stores = 0
+
+    @staticmethod
+    def make_key(*parts) -> str:
+        """
+        sha256 over the given parts (diff, Jira detail, base branch, template version, model...).
+        """
+        h = hashlib.sha256()
+        for part in parts:
+            h.update(str(part or "").encode("utf-8", errors="replace"))
+            h.update(b"\0")
+        return h.hexdigest()
+
+    def _connect(self):
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS reviews ("
+            "cache_key TEXT PRIMARY KEY, "
+            "model TEXT, "
+            "review TEXT NOT NULL, "
+            "post_check_score INTEGER, "
+            "post_check_reason TEXT, "
+            "created_at REAL NOT NULL, "
+            "last_used REAL NOT NULL)"
+        )
+
+    def _purge(self, now):
+        self._conn.execute("DELETE FROM reviews WHERE created_at < ?", (now - self.max_age,))
+        self._conn.execute(
+            "DELETE FROM reviews WHERE cache_key NOT IN "
+            "(SELECT cache_key FROM reviews ORDER BY last_used DESC LIMIT ?)",
+            (self.max_entries,)
+        )
+        self._last_purge = now
+
+    def get(self, key: str):
+        """
+        Return {"review", "post_check_score", "post_check_reason"} for a fresh entry, else None.
+        Storage errors count as a miss.
+        """
+        now = time.time()
+
+        with self._lock:
+            try:
+                if self._conn is None:
+                    self._connect()
+
+                row = self._conn.execute(
+                    "SELECT review, post_check_score, post_check_reason FROM reviews "
+                    "WHERE cache_key = ? AND created_at >= ?",
+                    (key, now - self.max_age)
+                ).fetchone()
+                if row:
+                    self._conn.execute("UPDATE reviews SET last_used = ? WHERE cache_key = ?", (now, key))
+
+            except sqlite3.Error as e:
+                self.logger.error(f"Review cache read error: {e}", exc_info=True)
+                row = None
+
+            if row:
+                self._hits += 1
+            else:
+                self._misses += 1
+
+        if not row:
+            return None
+        return {"review": row[0], "post_check_score": row[1], "post_check_reason": row[2]}
+
+    def put(self, key: str, review: str, post_check_score=None, post_check_reason=None, model: str = ""):
+        now = time.time()
+
+        with self._lock:
+            try:
+                if self._conn is None:
+                    self._connect()
+
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO reviews "
+                    "(cache_key, model, review, post_check_score, post_check_reason, created_at, last_used) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (key, model, review, post_check_score, post_check_reason, now, now)
+                )
+                self._stores += 1
+
+                if now - self._last_purge > self.purge_interval:
+                    self._purge(now)
+
+            except sqlite3.Error as e:
+                self.logger.error(f"Review cache write error: {e}", exc_info=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "max_entries": self.max_entries,
+                "max_age": self.max_age,
+                "hits": self._hits,
+                "misses": self._misses,
+                "stores": self._stores,
+                "hit_rate": round(self._hits / lookups, 3) if lookups else 0.0,
+            }
+
+    def close(self):
+        with self._lock:
+            if self._conn:
+                self._conn.close()
+                self._conn = None
+
+
+review_cache = ReviewCache()
@@ -0,0 +1,27 @@
+import threading
+
+
+class ReviewStats:
+    """
+    Per-process counters of reviews that were not sent to the AI.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._patch_skips = 0
+
+    def record_patch_skip(self) -> int:
+        """
+        Count a review reused as is because the new head has the same patch id as the reviewed one.
+        """
+        with self._lock:
+            self._patch_skips += 1
+            return self._patch_skips
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "patch_skips": self._patch_skips,
+            }
+
+
+review_stats = ReviewStats()
@@ -0,0 +1,80 @@
+import logging
+import threading
+
+from configs.config import DEFAULT_REVIEW_ROUTES, PROJECT_MAPPING
+from .tokens import estimate_tokens
+
+
+class ModelRouter:
+    """
+    Pick the model and endpoint of a review from the diff size, the changed file types and the project.
+    Rules come from `PROJECT_MAPPING[project]["Review_routes"]`, else `DEFAULT_REVIEW_ROUTES`.
+    """
+    def __init__(self, default_routes: list = DEFAULT_REVIEW_ROUTES, project_mapping: dict = PROJECT_MAPPING):
+        self.default_routes = default_routes
+        self.project_mapping = project_mapping
+
+        self.logger = logging.getLogger(__name__)
+
+        self._lock = threading.Lock()
+        self._routes = {}  # route name -> {"requests", "latency_total", "latency_max"}
+
+    def get_routes(self, project: str) -> list:
+        return self.project_mapping.get(project, {}).get("Review_routes") or self.default_routes
+
+    @staticmethod
+    def _matches(route, files, changed_lines, diff_tokens) -> bool:
+        if "max_changed_lines" in route and changed_lines > route["max_changed_lines"]:
+            return False
+        if "max_files" in route and len(files) > route["max_files"]:
+            return False
+        if "max_tokens" in route and diff_tokens > route["max_tokens"]:
+            return False
+        if "file_types" in route:
+            file_types = tuple(route["file_types"])
+            if not files or not all(f.path.lower().endswith(file_types) for f in files):
+                return False
+        return True
+
+    def select(self, project: str, pr_diff) -> dict:
+        """
+        Return the first matching route of `pr_diff` (a PRDiff): {"name", "model", "endpoint"}.
+        """
+        files = pr_diff.files
+        changed_lines = sum(f.additions + f.deletions for f in files)
+        diff_tokens = estimate_tokens(pr_diff.text)
+        routes = self.get_routes(project)
+
+        for route in routes:
+            if self._matches(route, files, changed_lines, diff_tokens):
+                break
+        else:
+            route = routes[-1]
+
+        self.logger.info(f"Route '{route.get('name', '')}' selected for {len(files)} files, {changed_lines} changed lines, ~{diff_tokens} tokens")
+        return {
+            "name": route.get("name", ""),
+            "model": route.get("model", ""),
+            "endpoint": route.get("endpoint", "vio"),
+        }
+
+    def record(self, route_name: str, latency: float):
+        with self._lock:
+            stats = self._routes.setdefault(route_name, {"requests": 0, "latency_total": 0.0, "latency_max": 0.0})
+            stats["requests"] += 1
+            stats["latency_total"] += latency
+            stats["latency_max"] = max(stats["latency_max"], latency)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                name: {
+                    "requests": s["requests"],
+                    "latency_avg": round(s["latency_total"] / s["requests"], 3) if s["requests"] else 0.0,
+                    "latency_max": round(s["latency_max"], 3),
+                }
+                for name, s in self._routes.items()
+            }
+
+
+model_router = ModelRouter()
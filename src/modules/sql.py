@@ -49,6 +49,13 @@ class PostgreSQL:
             self.logger.error("Query execution failed", exc_info=True)
             self.conn.rollback()
 
+    def add_columns(self, columns: dict):
+        """
+        Add the columns (name -> SQL type) the table does not have yet.
+        """
+        for name, sql_type in columns.items():
+            self.execute(f"ALTER TABLE {self.sql_table} ADD COLUMN IF NOT EXISTS {name} {sql_type}")
+
     def update(self, data: dict):
         """
         Update Everything
@@ -168,6 +175,35 @@ class PostgreSQL:
         except Exception as e:
             self.logger.error(f"Fetch table {self.sql_table} failed", exc_info=True)
 
+    def get_usage_summary(self, usage_table: str, days: int = 30):
+        """
+        AI usage per project (repository owner), repo, day and prompt template version over the last `days` days,
+        aggregated from `usage_table` (one row per AI call). Returns a list of dicts, most expensive first within each day.
+        """
+        query = f"""
+            SELECT repository_owner_login, repository_name, DATE(created_at) AS day, prompt_version,
+                   COUNT(DISTINCT html_url) AS prs,
+                   COUNT(*) AS calls,
+                   COALESCE(SUM(prompt_tokens), 0) AS prompt_tokens,
+                   COALESCE(SUM(completion_tokens), 0) AS completion_tokens,
+                   COALESCE(SUM(cached_tokens), 0) AS cached_tokens,
+                   AVG(latency) AS avg_latency,
+                   MAX(latency) AS max_latency
+            FROM {usage_table}
+            WHERE created_at >= NOW() - make_interval(days => %s)
+            GROUP BY repository_owner_login, repository_name, DATE(created_at), prompt_version
+            ORDER BY day DESC, prompt_tokens DESC
+        """
+        try:
+            self.cursor.execute(query, (days,))
+            headers = [desc[0] for desc in self.cursor.description]
+            return [dict(zip(headers, row)) for row in self.cursor.fetchall()]
+
+        except Exception as e:
+            self.logger.error(f"Fetch usage summary from {usage_table} failed", exc_info=True)
+            self.conn.rollback()
+            return []
+
     def _counter(self, sql_database):
         print("============================")
         categories = {
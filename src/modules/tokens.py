@@ -0,0 +1,99 @@
+from configs.config import MODEL_TOKEN_BUDGET, DEFAULT_TOKEN_BUDGET
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Fast local token estimate, no tokenizer and no network.
+    ASCII text averages ~4 chars per token, CJK and other non-ASCII text ~1 char per token.
+    """
+    if not text:
+        return 0
+    if text.isascii():
+        return len(text) // 4 + 1
+    # every non-ASCII char (mostly CJK, 3 bytes in UTF-8) adds ~2 bytes over its length
+    non_ascii = (len(text.encode("utf-8", errors="ignore")) - len(text)) // 2
+    return (len(text) - non_ascii) // 4 + non_ascii + 1
+
+
+def get_token_budget(model_name: str) -> int:
+    """
+    Max prompt tokens for a model, leaving room for the completion.
+    """
+    return MODEL_TOKEN_BUDGET.get(model_name, DEFAULT_TOKEN_BUDGET)
+
+
+TRUNCATION_NOTE_TOKENS = 8  # room reserved for the "...(truncated)" marker
+
+
+def trim_head(text: str, max_tokens: int) -> str:
+    """
+    Keep the beginning of `text` within `max_tokens`, cut at a line boundary.
+    """
+    ratio = len(text) / max(estimate_tokens(text), 1)
+    cut = text[:max(int((max_tokens - TRUNCATION_NOTE_TOKENS) * ratio), 0)]
+    if "\n" in cut:
+        cut = cut[:cut.rindex("\n") + 1]
+    return cut + "\n...(truncated)\n"
+
+
+def trim_tail(text: str, max_tokens: int) -> str:
+    """
+    Keep the end of `text` within `max_tokens`, cut at a line boundary. Used for histories where the latest entries matter.
+    """
+    ratio = len(text) / max(estimate_tokens(text), 1)
+    keep = int((max_tokens - TRUNCATION_NOTE_TOKENS) * ratio)
+    cut = text[len(text) - keep:] if keep > 0 else ""
+    if "\n" in cut:
+        cut = cut[cut.index("\n") + 1:]
+    return "...(truncated)\n" + cut
+
+
+class ContextPacker:
+    """
+    Fit prompt sections into a token budget by priority (lower number = more important).
+    When over budget, the least important sections are trimmed or dropped first; required sections are never touched.
+    """
+    def __init__(self, budget: int):
+        self.budget = budget
+        self.sections = []
+        self.dropped = []  # [{"section", "tokens", "kept_tokens"}]
+
+    def add(self, name: str, text: str, priority: int, required: bool = False, trimmer=trim_head):
+        self.sections.append({
+            "name": name,
+            "text": text or "",
+            "tokens": estimate_tokens(text or ""),
+            "priority": priority,
+            "required": required,
+            "trimmer": trimmer,
+        })
+
+    @property
+    def total_tokens(self) -> int:
+        return sum(section["tokens"] for section in self.sections)
+
+    def pack(self) -> dict:
+        """
+        Return {section name: packed text}. Trimmed/dropped sections are recorded in `self.dropped`.
+        """
+        overflow = self.total_tokens - self.budget
+
+        for section in sorted(self.sections, key=lambda x: x["priority"], reverse=True):
+            if overflow <= 0:
+                break
+            if section["required"] or not section["tokens"]:
+                continue
+
+            original_tokens = section["tokens"]
+            keep_tokens = original_tokens - overflow
+            if keep_tokens <= 0:
+                section["text"] = ""
+                section["tokens"] = 0
+            else:
+                section["text"] = section["trimmer"](section["text"], keep_tokens)
+                section["tokens"] = estimate_tokens(section["text"])
+
+            overflow -= original_tokens - section["tokens"]
+            self.dropped.append({"section": section["name"], "tokens": original_tokens, "kept_tokens": section["tokens"]})
+
+        return {section["name"]: section["text"] for section in self.sections}
@@ -0,0 +1,30 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.modules import PostgreSQL
+from src.RevBot import REVIEW_COLUMNS, USAGE_TABLE_DDL
+from configs.config import AI_USAGE_TABLE
+
+def main(sql_dbname, sql_user, sql_password, sql_host, sql_port, sql_table):
+    """
+    Bring the database up to the columns and tables the current RevBot writes. Safe to run repeatedly.
+    Restart the webhook afterwards, it reads the table columns once at startup.
+    """
+    sql = PostgreSQL(sql_dbname, sql_user, sql_password, sql_host, sql_port, sql_table)
+
+    sql.add_columns(REVIEW_COLUMNS)
+    print(f"{sql_table}: {len(REVIEW_COLUMNS)} columns checked")
+
+    sql.execute(USAGE_TABLE_DDL)
+    print(f"{AI_USAGE_TABLE}: table checked")
+
+if __name__ == '__main__':
+    sql_dbname = os.environ.get("SQL_DBNAME", "ai_ops_db")
+    sql_user = os.environ.get("SQL_USER", "ai_ops")
+    sql_password=os.environ.get("SQL_PASSWORD", "Conti12345!")
+    sql_host = os.environ.get("SQL_HOST", "10.214.149.31")
+    sql_port = os.environ.get("SQL_PORT", "5432")
+    sql_table = os.environ.get("SQL_TABLE", "model_pullrequest")
+
+    main(sql_dbname, sql_user, sql_password, sql_host, sql_port, sql_table)
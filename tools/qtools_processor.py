@@ -1,10 +1,17 @@
 import re
 import os
+import json
+import hashlib
+import tempfile
 import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 import pickle
 
-from configs.config import GITHUB_URL, PROJECT_MAPPING, ENV_PATH, LIB_PATH
+from configs.config import GITHUB_URL, PROJECT_MAPPING, ENV_PATH, LIB_PATH, QTOOLS_SYNC_WORKERS
+
+RULES_FORMAT = 2  # bump when the pkl layout changes, unchanged cfgs are then converted again
 
 class QtoolsProcessor:
     def __init__(
@@ -17,66 +24,125 @@ class QtoolsProcessor:
         self.save_folder = os.path.join(LIB_PATH, self.owner, 'qtools')
 
         self.token = os.getenv("GITHUB_TOKEN")
+        self.umask = os.umask(0)  # 读取 umask 只能先修改再恢复，在启动同步线程前完成
+        os.umask(self.umask)
         self.session = requests.Session()
-    
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=QTOOLS_SYNC_WORKERS)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
     def processor(self):
+        """
+        Sync the qtools cfg of every repo in parallel. Return repo -> "updated" / "unchanged" / "failed".
+        """
         if not os.path.exists(self.save_folder):
             os.makedirs(self.save_folder)
 
         repo_list = PROJECT_MAPPING[self.owner]['Repo']  # repo list
         qtools_cfg_url_list = PROJECT_MAPPING[self.owner]['Qtools_path']
 
-        for (repo, qtools_cfg_url) in zip(repo_list, qtools_cfg_url_list):
-            url = f"{GITHUB_URL}/api/v3/repos/{self.owner}/{repo}"
-            branch = self._get_default_branch(url)
+        with ThreadPoolExecutor(max_workers=QTOOLS_SYNC_WORKERS) as executor:
+            results = dict(zip(repo_list, executor.map(self._sync_repo, repo_list, qtools_cfg_url_list)))
 
-            url = f"{GITHUB_URL}/api/v3/repos/{self.owner}/{repo}/contents/{qtools_cfg_url}?ref={branch}"
+        for repo, result in results.items():
+            print(f"{repo}: {result}")
 
-            save_file_path = self._download_qtools_cfg(url, repo)  # download qtools cfg to local folder
+        return results
 
-            if save_file_path:
-                self._convert_cfg_to_dict(save_file_path)
-    
-    def _get_default_branch(self, url):
-        headers = {
-            "Authorization": f"token {self.token}",
-            "Accept": "application/vnd.github.v3+json"
-        }
+    def _sync_repo(self, repo, qtools_cfg_url):
+        # 不带 ref 时 contents API 默认读取默认分支，省去一次仓库信息查询
+        url = f"{GITHUB_URL}/api/v3/repos/{self.owner}/{repo}/contents/{qtools_cfg_url}"
+        state_path = os.path.join(self.save_folder, f'{repo}.json')
+        state = self._load_state(state_path)
+        if state.get("url") != url or state.get("format") != RULES_FORMAT or not os.path.exists(os.path.join(self.save_folder, f'{repo}.pkl')):
+            state = {}
 
         try:
-            resp = self.session.get(url, headers=headers)
-            resp.raise_for_status()
-
-            default_branch = resp.json().get("default_branch")
-            
-            return default_branch
+            content, etag = self._download_qtools_cfg(url, state.get("etag"))
+        except Exception as e:
+            print(f"{repo} qtools cfg 下载失败：{e}")
+            return "failed"
+
+        if content is None:  # 304 Not Modified
+            return "unchanged"
+
+        # ETag 变化但内容相同（例如默认分支有其他提交）时不重新解析
+        sha = self._get_blob_sha(content)
+        if sha == state.get("sha"):
+            result = "unchanged"
+        else:
+            try:
+                save_file_path = os.path.join(self.save_folder, f'{repo}.cfg')
+                self._atomic_write(save_file_path, content)  # download qtools cfg to local folder
+                self._convert_cfg_to_dict(save_file_path)
+            except Exception as e:
+                print(f"{repo} qtools cfg 解析失败：{e}")
+                return "failed"
+            result = "updated"
 
+        try:
+            self._atomic_write(state_path, json.dumps({"url": url, "etag": etag, "sha": sha, "format": RULES_FORMAT}).encode("utf-8"))
         except Exception as e:
-            print(f"请求失败，状态码：{resp.status_code}，内容：{resp.text}")
+            print(f"{repo} qtools 同步状态保存失败：{e}")
+            return "failed"
+        return result
 
-            return None
-        
-    def _download_qtools_cfg(self, url, repo):
+    def _load_state(self, state_path):
+        try:
+            with open(state_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _get_blob_sha(self, content):
+        """
+        Git blob sha of the content, same as the `sha` the contents API reports for the file.
+        """
+        return hashlib.sha1(b"blob %d\0" % len(content) + content).hexdigest()
+
+    def _atomic_write(self, path, data):
+        """
+        Write to a temp file in the same folder and rename it over `path`, so readers
+        (the webhook's qtools rule index) never see a half-written file.
+        The file keeps the mode of the file it replaces, new files get the umask default.
+        """
+        try:
+            mode = os.stat(path).st_mode & 0o777
+        except FileNotFoundError:
+            mode = 0o666 & ~self.umask
+
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fchmod(f.fileno(), mode)  # mkstemp 创建的文件权限为 0600
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _download_qtools_cfg(self, url, etag=None):
+        """
+        Conditional download of the cfg. Return (content, etag), content is None when unchanged (304).
+        """
         headers = {
             "Authorization": f"token {self.token}",
             "Accept": "application/vnd.github.raw+json"
         }
+        if etag:
+            headers["If-None-Match"] = etag
 
-        try:
-            resp = self.session.get(url, headers=headers)
-            resp.raise_for_status()
-
-            save_file_path = os.path.join(self.save_folder,f'{repo}.cfg')
+        resp = self.session.get(url, headers=headers)
+        if resp.status_code == 304:
+            return None, etag
 
-            with open(save_file_path, "wb") as f:
-                f.write(resp.content)
-            
-            return save_file_path
+        if not resp.ok:
+            raise RuntimeError(f"状态码：{resp.status_code}，内容：{resp.text}")
 
-        except Exception as e:
-            print(f"请求失败，状态码：{resp.status_code}，内容：{resp.text}")
-            
-            return None
+        return resp.content, resp.headers.get("ETag")
 
     def _convert_cfg_to_dict(self, save_file_path):
         line_pattern = re.compile(
@@ -102,13 +168,16 @@ class QtoolsProcessor:
                     guidline = m.group(3)
                     description = m.group(4).strip()
 
+                    kind = 'file'
                     if raw_file == '*':
                         filename = '*'
+                        kind = 'all'
                     else:
                         if raw_file.upper().startswith('ANY\\'):
                             filename = raw_file[4:]
                         elif raw_file.startswith('"FP.FilePath CONTAINS '):
                             filename = raw_file[23:-2]
+                            kind = 'contains'  # 路径子串匹配，与是否含目录无关
                         else:
                             filename = raw_file
 
@@ -120,6 +189,7 @@ class QtoolsProcessor:
 
                         if filename not in rules_dict:
                             rules_dict[filename] = {
+                                'kind': kind,
                                 'code_rules': [],
                                 'code_rule_chapters': [],
                                 'descriptions': []
@@ -137,8 +207,7 @@ class QtoolsProcessor:
         base, _ = os.path.splitext(save_file_path)
         rules_dict_file_path = base + ".pkl"
 
-        with open(rules_dict_file_path, 'wb') as f:
-            pickle.dump(rules_dict, f)
+        self._atomic_write(rules_dict_file_path, pickle.dumps(rules_dict))
 
         return rules_dict
 
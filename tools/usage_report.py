@@ -0,0 +1,37 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.modules import PostgreSQL
+from configs.config import PROJECT_MAPPING, AI_USAGE_TABLE
+
+def main(sql_dbname, sql_user, sql_password, sql_host, sql_port, sql_table, days):
+    sql = PostgreSQL(sql_dbname, sql_user, sql_password, sql_host, sql_port, sql_table)
+
+    rows = sql.get_usage_summary(usage_table=AI_USAGE_TABLE, days=days)
+
+    print("============================")
+    print(f"{'day':<12}{'project':<14}{'repo':<40}{'prompt':<14}{'prs':>5}{'calls':>7}{'prompt_tok':>12}{'compl_tok':>11}{'cached':>8}{'avg_s':>8}")
+    for row in rows:
+        project = PROJECT_MAPPING.get(row["repository_owner_login"], {}).get("Project", row["repository_owner_login"])
+        avg_latency = row["avg_latency"] or 0
+        cache_hit_rate = row["cached_tokens"] / row["prompt_tokens"] if row["prompt_tokens"] else 0
+        print(f"{str(row['day']):<12}{str(project):<14}{str(row['repository_name']):<40}{str(row['prompt_version'] or '-'):<14}"
+              f"{row['prs']:>5}{row['calls']:>7}{row['prompt_tokens']:>12}{row['completion_tokens']:>11}{cache_hit_rate:>8.1%}{avg_latency:>8.1f}")
+
+    print("----------------------------")
+    print(f"Total prompt tokens: {sum(row['prompt_tokens'] for row in rows)}")
+    print(f"Total completion tokens: {sum(row['completion_tokens'] for row in rows)}")
+    print(f"Total cached prompt tokens: {sum(row['cached_tokens'] for row in rows)}")
+    print("============================")
+
+if __name__ == '__main__':
+    sql_dbname = os.environ.get("SQL_DBNAME", "ai_ops_db")
+    sql_user = os.environ.get("SQL_USER", "ai_ops")
+    sql_password=os.environ.get("SQL_PASSWORD", "Conti12345!")
+    sql_host = os.environ.get("SQL_HOST", "10.214.149.31")
+    sql_port = os.environ.get("SQL_PORT", "5432")
+    sql_table = os.environ.get("SQL_TABLE", "model_pullrequest")
+    days = int(sys.argv[1]) if len(sys.argv) > 1 else 30
+
+    main(sql_dbname, sql_user, sql_password, sql_host, sql_port, sql_table, days)
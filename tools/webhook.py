@@ -1,19 +1,74 @@
-from flask import request, Flask
+from flask import request, Flask, jsonify
+from werkzeug.datastructures import Headers
 import sys
 import os
+import logging
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from  main import main
+from src.modules import ReviewJobQueue, pr_coalescer, delivery_store, github_pool, review_cache, review_stats, ai_clients, vio_keys, ai_hedge, ai_admission, model_router, prompt_registry, qtools_rules
+from configs.config import WEBHOOK_WORKERS, WEBHOOK_QUEUE_SIZE
+
+
+class WebhookRequest:
+    """
+    Detached copy of the Flask request, safe to use from worker threads after the response is sent.
+    """
+    def __init__(self, headers, json):
+        self.headers = headers
+        self.json = json
+
 
 class PRHookApp:
     def __init__(self):
         self.app = Flask(__name__)
+        self.job_queue = ReviewJobQueue(handler=main, workers=WEBHOOK_WORKERS, maxsize=WEBHOOK_QUEUE_SIZE)
+        self.job_queue.start()
+        self.coalescer = pr_coalescer
+        self.coalescer.dispatch = self.job_queue.submit
+        prompt_registry.load()  # read the prompt templates once at startup
         self.add_routes()
 
     def add_routes(self):
         self.app.add_url_rule('/revbot-webhook/', view_func=self.pr_webhook, methods=['POST'])
+        self.app.add_url_rule('/revbot-webhook/stats', view_func=self.queue_stats, methods=['GET'])
 
     def pr_webhook(self):
-       return main(request=request)
+        event = request.headers.get('X-GitHub-Event', None)
+        payload = request.get_json(silent=True)
+
+        if not event or not isinstance(payload, dict):
+            return "Bad Request", 400
+
+        # 重复投递的事件在进入合并窗口之前丢弃，避免替换同一 PR 的待审查事件
+        delivery_id = request.headers.get('X-GitHub-Delivery', None)
+        if delivery_store.is_duplicate(delivery_id, event=event):
+            logging.getLogger(__name__).info(f"Drop duplicate delivery {delivery_id}, EVENT={event}, ACTION={payload.get('action')}, total duplicates={delivery_store.stats()['duplicates']}")
+            return "Duplicate", 200
+
+        job_request = WebhookRequest(headers=Headers(list(request.headers.items())), json=payload)
+
+        if not self.coalescer.submit(event, job_request):
+            delivery_store.forget(delivery_id)  # GitHub 重新投递时不应视为重复
+            return "Queue Full", 503
+
+        return "Accepted", 202
+
+    def queue_stats(self):
+        return jsonify({
+            "queue": self.job_queue.stats(),
+            "coalescer": self.coalescer.stats(),
+            "deliveries": delivery_store.stats(),
+            "github_pool": github_pool.stats(),
+            "review_cache": review_cache.stats(),
+            "review_stats": review_stats.stats(),
+            "ai_clients": ai_clients.stats(),
+            "vio_keys": vio_keys.stats(),
+            "ai_hedge": ai_hedge.stats(),
+            "ai_admission": ai_admission.stats(),
+            "model_routes": model_router.stats(),
+            "prompt_templates": prompt_registry.stats(),
+            "qtools_rules": qtools_rules.stats(),
+        })
 
 pr_hook_app = PRHookApp()
 app = pr_hook_app.app